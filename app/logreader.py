@@ -0,0 +1,92 @@
+'''
+从新到旧读取 web.log 的日志
+
+从文件末尾按块向前读取，逐行惰性返回，读完 web-log.log 后继续读取轮转出的
+web-log.log.1 至 web-log.log.10，读取量只与实际返回的行数有关，与文件大小无关。
+'''
+import json
+import os
+
+from django.conf import settings
+
+BLOCK_SIZE = 8192
+
+
+def log_files(log_file: str = None) -> list:
+    ''' 当前日志文件及其轮转备份，从新到旧 '''
+    log_file = log_file or settings.LOGS_FILE_DIR
+    backups = settings.LOGGING['handlers']['restful_api']['backupCount']
+    return [log_file] + [f'{log_file}.{i}' for i in range(1, backups + 1)]
+
+
+def reverse_lines(path: str, block_size: int = BLOCK_SIZE):
+    ''' 从后向前逐行读取文件，跳过空行，文件不存在时不返回任何行 '''
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with file:
+        position = file.seek(0, os.SEEK_END)
+        rest = b''
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            lines = (file.read(step) + rest).split(b'\n')
+            rest = lines[0]  # 可能是不完整的一行，与前一块拼接
+            for line in reversed(lines[1:]):
+                if line.strip():
+                    yield line.rstrip(b'\r').decode('utf-8', errors='replace')
+        if rest.strip():
+            yield rest.rstrip(b'\r').decode('utf-8', errors='replace')
+
+
+def first_time(path: str) -> str:
+    ''' 文件中最早一条记录的时间，文件不存在或没有可解析的记录时为空串 '''
+    try:
+        file = open(path, encoding='utf-8', errors='replace')
+    except FileNotFoundError:
+        return ''
+    with file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict):
+                return record.get('time', '')
+    return ''
+
+
+def iter_logs(username='', path='', method='', start='', end='', log_file: str = None,
+              before: str = ''):
+    '''
+    从新到旧返回日志记录，跳过无法解析的行
+    username, method 精确匹配，path 前缀匹配，
+    start, end 为闭区间，格式同日志的时间，如 2020-01-01 或 2020-01-01 08:00:00
+    before 不为空时只返回早于它的记录，最早的记录也不早于它的文件整个跳过
+    '''
+    for name in log_files(log_file):
+        if before and first_time(name) >= before:
+            continue
+        for line in reverse_lines(name):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(record, dict):
+                continue
+            time = record.get('time', '')
+            if before and time >= before:
+                continue
+            if start and time < start:
+                return  # 更早的记录都不在范围内
+            if end and time[:len(end)] > end:
+                continue
+            if username and record.get('username') != username:
+                continue
+            if method and record.get('method') != method:
+                continue
+            if path and not record.get('path', '').startswith(path):
+                continue
+            yield record
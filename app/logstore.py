@@ -0,0 +1,193 @@
+'''
+web.log 日志的索引存储
+
+LogStoreHandler 将日志攒批写入本地的 SQLite 文件 (settings.LOG_STORE_PATH)，
+表上有时间、用户名、路径的索引，query_logs 按条件查询时不需要扫描日志文件。
+超过 LOG_STORE_RETENTION_DAYS 天的记录由写入日志的进程定期删除。
+缓冲中的记录在批满或进程退出时写入，各进程另有一个线程每 LOG_STORE_FLUSH_INTERVAL 秒写入一次，
+查询前只能刷新当前进程的缓冲，空闲的进程中的记录也最多延迟一个写入间隔。
+'''
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_FIELDS = ('time', 'method', 'path', 'message', 'username')
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS logs (
+    id INTEGER PRIMARY KEY,
+    time TEXT NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    message TEXT NOT NULL,
+    username TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS logs_time ON logs (time);
+CREATE INDEX IF NOT EXISTS logs_username_time ON logs (username, time);
+CREATE INDEX IF NOT EXISTS logs_path_time ON logs (path, time);
+'''
+
+
+def connect(path: str = None) -> sqlite3.Connection:
+    ''' 打开日志库，不存在时建表，WAL 模式下多个进程可以同时写入和查询 '''
+    conn = sqlite3.connect(path or settings.LOG_STORE_PATH, timeout=10, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def prune_logs(conn: sqlite3.Connection, days: int) -> int:
+    ''' 删除 days 天以前的记录，return: 删除的条数 '''
+    cutoff = (datetime.now() - timedelta(days=days)).strftime(TIME_FORMAT)
+    with conn:
+        return conn.execute('DELETE FROM logs WHERE time < ?', (cutoff,)).rowcount
+
+
+def log_conditions(username='', path='', method='', start='', end='') -> tuple:
+    '''
+    查询条件同 app.logreader.iter_logs:
+    username, method 精确匹配，path 前缀匹配，start, end 为闭区间
+    return: (WHERE 子句，可能为空串, 参数列表)
+    '''
+    where, params = [], []
+    if username:
+        where.append('username = ?')
+        params.append(username)
+    if method:
+        where.append('method = ?')
+        params.append(method)
+    if path:  # 前缀改写为范围条件以使用索引
+        where.append('path >= ? AND path < ?')
+        params += [path, path + '\U0010ffff']
+    if start:
+        where.append('time >= ?')
+        params.append(start)
+    if end:  # 2020-01-01 包含当天的所有记录
+        where.append('time < ?')
+        params.append(end + '\U0010ffff')
+    return (' WHERE ' + ' AND '.join(where) if where else ''), params
+
+
+def query_logs(conn: sqlite3.Connection, offset=0, size=20, username='', path='', method='',
+               start='', end='') -> list:
+    ''' 从新到旧查询日志，条件见 log_conditions '''
+    where, params = log_conditions(username, path, method, start, end)
+    sql = (f'SELECT {", ".join(LOG_FIELDS)} FROM logs{where} '
+           'ORDER BY time DESC, id DESC LIMIT ? OFFSET ?')
+    rows = conn.execute(sql, params + [size, offset])
+    return [dict(zip(LOG_FIELDS, row)) for row in rows]
+
+
+def count_logs(conn: sqlite3.Connection, username='', path='', method='', start='',
+               end='') -> int:
+    ''' 符合条件的记录数，条件见 log_conditions '''
+    where, params = log_conditions(username, path, method, start, end)
+    return conn.execute(f'SELECT COUNT(*) FROM logs{where}', params).fetchone()[0]
+
+
+def first_log_time(conn: sqlite3.Connection) -> str:
+    ''' 日志库中最早的记录的时间，日志库为空时为空串，更早的记录只在日志文件中 '''
+    return conn.execute('SELECT MIN(time) FROM logs').fetchone()[0] or ''
+
+
+class LogStoreHandler(logging.Handler):
+    '''
+    攒批写入日志库的 Handler，需配合 app.middlewares.RequestLogFilter 使用
+
+    例 (settings.LOGGING['handlers']):
+    'log_store': {
+        'class': 'app.logstore.LogStoreHandler',
+        'filters': ['request_info'],
+    }
+    '''
+
+    def __init__(self, path: str = None, batch_size: int = None, flush_interval: float = None,
+                 retention_days: int = None):
+        super().__init__()
+        self.path = path
+        self.batch_size = batch_size or settings.LOG_STORE_BATCH_SIZE
+        self.flush_interval = (settings.LOG_STORE_FLUSH_INTERVAL if flush_interval is None
+                               else flush_interval)
+        self.retention_days = retention_days or settings.LOG_STORE_RETENTION_DAYS
+        self.buffer = []
+        self.conn = None
+        self.conn_path = None  # 未指定 path 时 settings.LOG_STORE_PATH 可能改变，如测试中
+        self.last_flush = time.monotonic()
+        self.last_prune = 0
+        self.stopped = threading.Event()
+        self.flusher = None
+        self.flusher_pid = None
+
+    def start_flusher(self):
+        ''' 启动定时写入的线程，线程不随 fork 复制，子进程中重新启动 '''
+        if self.flush_interval > 0 and self.flusher_pid != os.getpid():
+            self.flusher_pid = os.getpid()
+            self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+            self.flusher.start()
+
+    def flush_periodically(self):
+        ''' 每隔 flush_interval 秒写入一次，直到 close '''
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+
+    def emit(self, record):
+        if not (self.path or settings.LOG_STORE_PATH):
+            return
+        self.start_flusher()
+        row = (time.strftime(TIME_FORMAT, time.localtime(record.created)),
+               getattr(record, 'method', 'unknown'), getattr(record, 'path', 'unknown'),
+               record.getMessage(), getattr(record, 'username', 'unknown'))
+        self.buffer.append(row)
+        if (len(self.buffer) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        ''' 将缓冲中的记录一次写入，每小时至多清理一次过期记录 '''
+        self.acquire()
+        try:
+            rows, self.buffer = self.buffer, []
+            self.last_flush = time.monotonic()
+            path = self.path or settings.LOG_STORE_PATH
+            if not rows or not path:
+                return
+            if self.conn is not None and self.conn_path != path:
+                self.conn.close()
+                self.conn = None
+            if self.conn is None:
+                self.conn, self.conn_path = connect(path), path
+            with self.conn:
+                self.conn.executemany(
+                    f'INSERT INTO logs ({", ".join(LOG_FIELDS)}) VALUES (?, ?, ?, ?, ?)', rows)
+            if self.last_flush - self.last_prune >= 60 * 60:
+                self.last_prune = self.last_flush
+                prune_logs(self.conn, self.retention_days)
+        except sqlite3.Error:
+            self.handleError(None)
+        finally:
+            self.release()
+
+    def close(self):
+        self.stopped.set()
+        self.flush()
+        self.acquire()
+        try:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+        finally:
+            self.release()
+        super().close()
+
+
+def flush_handlers(logger_name: str = 'web.log'):
+    ''' 写入当前进程中缓冲的记录，查询前调用 '''
+    for handler in logging.getLogger(logger_name).handlers:
+        if isinstance(handler, LogStoreHandler):
+            handler.flush()
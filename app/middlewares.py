@@ -25,6 +25,8 @@ class RequestLogFilter(DummyBase):
 class RequestLogMiddleware(MiddlewareMixin):
     '''
     将request的信息记录在当前的请求线程上。
+    同时验证一次 token，结果 (用户, 'OK' 或错误信息) 记为 request.auth_context，
+    供 auth_permission_required 直接使用
     '''
 
     def __init__(self, get_response=None):
@@ -35,14 +37,16 @@ class RequestLogMiddleware(MiddlewareMixin):
 
         LOCAL.path = request.path
         LOCAL.method = request.method
-        from user.models import User
-        try:
-            token = request.COOKIES['Token']
-            decoded = jwt.decode(token, verify=False)
-            LOCAL.username = decoded['username']
-            request.user = User.objects.get(username=decoded['username'])
-        except (KeyError, jwt.PyJWTError, User.DoesNotExist):
-            pass
+        from user.utils import authenticate
+        user, verified = request.auth_context = authenticate(request.COOKIES)
+        if user is not None:
+            LOCAL.username = user.username
+            request.user = user
+        elif verified != 'Token 未给出':  # 过期等情况下仍记录 token 中的用户名
+            try:
+                LOCAL.username = jwt.decode(request.COOKIES['Token'], verify=False)['username']
+            except (KeyError, jwt.PyJWTError):
+                pass
 
         response = self.get_response(request)
 
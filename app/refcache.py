@@ -0,0 +1,93 @@
+'''
+进程内的参考数据缓存
+
+资产类别、部门、自定义属性等很少修改的数据缓存在各进程的内存中。
+每类数据在 settings.REFCACHE_DIR 下有一个版本戳文件，修改数据时调用 invalidate 更新其 mtime，
+各进程每次读取前比较 mtime，一次 stat 即可让所有 worker 的缓存失效。
+'''
+import os
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+_NAMES = set()
+
+
+def stamp_path(name: str) -> str:
+    ''' 版本戳文件的路径 '''
+    return os.path.join(settings.REFCACHE_DIR, name)
+
+
+def read_stamp(name: str) -> int:
+    ''' 版本戳，文件不存在时为 0 '''
+    try:
+        return os.stat(stamp_path(name)).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def touch(name: str):
+    ''' 更新版本戳，保证严格递增，以免文件系统时间精度不足时两次修改得到相同的戳 '''
+    stamp = max(time.time_ns(), read_stamp(name) + 1000)
+    os.makedirs(settings.REFCACHE_DIR, exist_ok=True)
+    with open(stamp_path(name), 'a'):
+        pass
+    os.utime(stamp_path(name), ns=(stamp, stamp))
+
+
+def invalidate(name: str):
+    ''' 使 name 的缓存在所有进程中失效
+    当前事务提交后再更新一次，以免其他进程在提交前重新加载到旧的数据 '''
+    touch(name)
+    transaction.on_commit(lambda: touch(name))
+
+
+def remove(name: str):
+    ''' 删除不再使用的版本戳，读取时视为 0，同样使所有进程中的缓存失效 '''
+    def unlink():
+        try:
+            os.remove(stamp_path(name))
+        except FileNotFoundError:
+            pass
+    unlink()
+    transaction.on_commit(unlink)
+
+
+def invalidate_all():
+    ''' 使所有缓存失效 '''
+    for name in _NAMES:
+        touch(name)
+
+
+def copy_instance(instance):
+    ''' 缓存的模型实例的独立副本，调用者修改副本不影响缓存及其他线程 '''
+    model = type(instance)
+    fields = model._meta.concrete_fields
+    return model.from_db(instance._state.db, [field.attname for field in fields],
+                         [getattr(instance, field.attname) for field in fields])
+
+
+class RefCache:
+    '''
+    一项缓存的数据，由 loader 加载，名称相同的缓存共用一个版本戳
+    缓存的数据在线程间共享，模型实例应以 copy_instance 复制后交给调用者
+
+    例:
+    CATEGORIES = RefCache('asset_category', lambda: list(AssetCategory.objects.all()))
+    CATEGORIES.get()
+    '''
+
+    def __init__(self, name: str, loader):
+        _NAMES.add(name)
+        self.name = name
+        self.loader = loader
+        self.entry = None  # (版本戳, 数据)，整体替换，其他线程不会读到不匹配的一对
+
+    def get(self):
+        ''' 版本戳未变时返回缓存的数据，返回的数据不应被修改 '''
+        stamp = read_stamp(self.name)  # 先读版本戳，加载期间的修改会使下次读取重新加载
+        entry = self.entry
+        if entry is None or entry[0] != stamp:
+            entry = self.entry = (stamp, self.loader())
+        return entry[1]
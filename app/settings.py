@@ -139,11 +139,42 @@ STATIC_URL = '/static/'
 # Local settings
 STATICFILES_DIR = os.path.join(BASE_DIR, 'static')
 
+# 进程内参考数据缓存的版本戳文件，见 app/refcache.py，同一部署的所有 worker 须使用同一目录
+REFCACHE_DIR = os.environ.get('REFCACHE_DIR') or os.path.join(BASE_DIR, 'run', 'refcache')
+
+# 已验证 token 的进程内缓存，见 user.utils.TokenCache
+TOKEN_CACHE_SIZE = 4096
+TOKEN_CACHE_TTL = 60
+
+# 密码哈希的进程池，见 user/hashing.py，排队的任务超过 PASSWORD_POOL_QUEUE 时返回 503
+PASSWORD_POOL_SIZE = 2
+PASSWORD_POOL_QUEUE = 16
+PASSWORD_POOL_TIMEOUT = 30
+
+# 资产历史记录的归档，见 asset/management/commands/archive_history.py
+HISTORY_ARCHIVE_DAYS = 365
+HISTORY_ARCHIVE_INTERVAL = 24 * 60 * 60
+# 资产历史记录的存储方式：'full' 每条记录保存完整的资产，'delta' 只保存变化的字段，
+# 见 asset.models.AssetHistoryDelta
+ASSET_HISTORY_BACKEND = 'full'
+HISTORY_SNAPSHOT_INTERVAL = 20
+# 自定义属性的存储方式：'eav' 每个属性值一行 AssetCustomAttr，'json' 存放在 Asset.custom_attrs 中
+# 切换前先以 python manage.py custom_attr_storage {eav,json} 转换已有的属性值
+CUSTOM_ATTR_STORAGE = 'eav'
+# 被删除的自定义属性的清理，见 asset/management/commands/purge_custom_attrs.py
+CUSTOM_ATTR_PURGE_INTERVAL = 60 * 60
+
 # Logging
 LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 LOGS_FILE_DIR = os.path.join(LOGS_DIR, 'web-log.log')
 os.makedirs(LOGS_DIR, exist_ok=True)
 
+# 日志库，/api/logs 由此查询，设为空时改为从后向前读取日志文件
+LOG_STORE_PATH = os.path.join(LOGS_DIR, 'web-log.sqlite3')
+LOG_STORE_BATCH_SIZE = 100
+LOG_STORE_FLUSH_INTERVAL = 5
+LOG_STORE_RETENTION_DAYS = 365
+
 LOGING_FORMAT = ('{"time": "%(asctime)s", "method": "%(method)s", '
                  '"path": "%(path)s", "message": "%(message)s", "username": "%(username)s"}')
 
@@ -161,6 +192,12 @@ LOGGING = {
         'request_info': {'()': 'app.middlewares.RequestLogFilter'},
     },
     'handlers': {
+        # 同时写入有索引的日志库，见 app/logstore.py
+        'log_store': {
+            'level': 'INFO',
+            'class': 'app.logstore.LogStoreHandler',
+            'filters': ['request_info'],
+        },
         # 自定义 handlers，输出到文件
         'restful_api': {
             'level': 'INFO',
@@ -175,7 +212,7 @@ LOGGING = {
     },
     'loggers': {
         'web.log': {
-            'handlers': ['restful_api'],
+            'handlers': ['restful_api', 'log_store'],
             'level': 'INFO',
             # 此记录器处理过的消息就不再让 django 记录器再次处理了
             'propagate': False
@@ -1,9 +1,19 @@
 ''' app/tests.py '''
 import json
+import logging
+import os
+import tempfile
+import time
+from functools import partial
 
+from django.conf import settings
 from django.test import TestCase
 
+from app import logreader, logstore, refcache
 from app.utils import init_test, parse_list
+from asset.models import AssetCategory
+from department.models import Department
+from user.apps import init_category
 
 
 class AppTests(TestCase):
@@ -29,6 +39,120 @@ class AppTests(TestCase):
             {'offset': 1, 'size': 1}), content_type='json')
         self.assertEqual(response.json()['code'], 200)
 
+        self.assertTrue(settings.LOG_STORE_PATH.startswith(tempfile.gettempdir()))
+        # 早于日志库中最早记录的部分从日志文件中读取，不重复返回日志库中已有的记录
+        with tempfile.TemporaryDirectory() as logs_dir:
+            log_file = os.path.join(logs_dir, 'web-log.log')
+            records = [{'time': time, 'method': 'POST', 'path': path, 'message': time,
+                        'username': 'admin'} for time in ('2020-01-01 08:00:00', '2999-01-01')]
+            with open(log_file, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(json.dumps(record) for record in records) + '\n')
+            with self.settings(LOGS_FILE_DIR=log_file):
+                data = self.client.post(path, json.dumps({'size': 100}),
+                                        content_type='json').json()['data']
+                self.assertEqual(data[-1], records[0])
+                self.assertNotIn(records[1], data)
+                stored = len(data) - 1
+                data = self.client.post(path, json.dumps({'offset': stored, 'size': 2}),
+                                        content_type='json').json()['data']
+                self.assertListEqual(data, [records[0]])
+
+    def test_logreader(self):
+        ''' 测试从新到旧跨轮转文件读取日志 '''
+        with tempfile.TemporaryDirectory() as logs_dir:
+            log_file = os.path.join(logs_dir, 'web-log.log')
+            records = [{'time': f'2020-01-{day:02d} 08:00:00', 'method': 'POST',
+                        'path': f'/api/{app}/list', 'message': '资产' * day,
+                        'username': user}
+                       for day, (app, user) in enumerate([('asset', 'admin'), ('user', 'a'),
+                                                          ('asset', 'a'), ('user', 'admin'),
+                                                          ('asset', 'admin')], 1)]
+            lines = [json.dumps(record, ensure_ascii=False) for record in records]
+            # .2 最旧，当前文件最新，.1 中夹有无法解析的行
+            for name, part in [('.2', lines[:2]), ('.1', lines[2:3] + ['{bad'] + lines[3:4]),
+                               ('', lines[4:])]:
+                with open(log_file + name, 'w', encoding='utf-8') as file:
+                    file.write('\n'.join(part) + '\n')
+
+            self.assertEqual(list(logreader.reverse_lines(log_file + '.1', block_size=7)),
+                             [lines[3], '{bad', lines[2]])
+            self.assertEqual(list(logreader.iter_logs(log_file=log_file)), records[::-1])
+            filtered = logreader.iter_logs(username='admin', path='/api/asset',
+                                           log_file=log_file)
+            self.assertEqual([log['time'][8:10] for log in filtered], ['05', '01'])
+            filtered = logreader.iter_logs(start='2020-01-02', end='2020-01-04',
+                                           log_file=log_file)
+            self.assertEqual([log['time'][8:10] for log in filtered], ['04', '03', '02'])
+            self.assertEqual(logreader.first_time(log_file + '.1'), records[2]['time'])
+            self.assertEqual(logreader.first_time(log_file + '.3'), '')
+            # .1 中最早的记录也不早于 before，整个文件被跳过，即使其中夹有更早的行
+            with open(log_file + '.1', 'a', encoding='utf-8') as file:
+                file.write(lines[0] + '\n')
+            filtered = logreader.iter_logs(before=records[2]['time'], log_file=log_file)
+            self.assertEqual([log['time'][8:10] for log in filtered], ['02', '01'])
+
+        path = '/api/logs'
+        response = self.client.post(path, json.dumps({'offset': -1}), content_type='json')
+        self.assertEqual(response.json()['code'], 201)
+        response = self.client.post(path, json.dumps({'username': 'admin', 'size': 5}),
+                                    content_type='json')
+        self.assertTrue(all(log['username'] == 'admin' for log in response.json()['data']))
+
+    def test_logstore(self):
+        ''' 测试日志库的攒批写入、查询和清理 '''
+        def log(created, username, path):
+            record = logging.LogRecord('web.log', logging.INFO, __file__, 0, path, (), None)
+            record.created = time.mktime(time.strptime(created, logstore.TIME_FORMAT))
+            record.username, record.path, record.method = username, path, 'POST'
+            handler.handle(record)
+
+        with tempfile.TemporaryDirectory() as logs_dir:
+            db_path = os.path.join(logs_dir, 'logs.sqlite3')
+            handler = logstore.LogStoreHandler(db_path, batch_size=3, flush_interval=3600,
+                                               retention_days=100 * 365)
+            log('2020-01-01 08:00:00', 'admin', '/api/asset/list')
+            log('2020-01-02 08:00:00', 'a', '/api/asset/add')
+            self.assertEqual(len(handler.buffer), 2)
+            log('2020-02-01 08:00:00', 'admin', '/api/user/list')  # 批满写入
+            log('2020-02-02 08:00:00', 'admin', '/api/asset/add')
+            handler.close()
+
+            conn = logstore.connect(db_path)
+            query = partial(logstore.query_logs, conn)
+            self.assertEqual([log['time'][:10] for log in query()],
+                             ['2020-02-02', '2020-02-01', '2020-01-02', '2020-01-01'])
+            self.assertEqual([log['path'] for log in query(username='admin', path='/api/asset')],
+                             ['/api/asset/add', '/api/asset/list'])
+            self.assertEqual([log['username'] for log in query(start='2020-01-02',
+                                                               end='2020-02-01')],
+                             ['admin', 'a'])
+            self.assertEqual(len(query(offset=1, size=2)), 2)
+            plan = ' '.join(row[3] for row in conn.execute(
+                'EXPLAIN QUERY PLAN SELECT * FROM logs WHERE username = ? AND time >= ?',
+                ('admin', '2020-01-01')))
+            self.assertIn('logs_username_time', plan)
+            self.assertEqual(logstore.prune_logs(conn, 0), 4)
+            conn.close()
+
+            # 空闲的进程中缓冲的记录由定时线程写入
+            handler = logstore.LogStoreHandler(db_path, flush_interval=0.05,
+                                               retention_days=100 * 365)
+            log('2020-03-01 08:00:00', 'admin', '/api/asset/list')
+            conn = logstore.connect(db_path)
+            for _ in range(100):
+                if logstore.count_logs(conn):
+                    break
+                time.sleep(0.05)
+            self.assertEqual(logstore.count_logs(conn), 1)
+            handler.close()
+            handler.flusher.join()
+            conn.close()
+
+        path = '/api/logs'
+        response = self.client.post(path, json.dumps({'username': 'admin', 'path': '/api/user',
+                                                      'size': 1}), content_type='json')
+        self.assertEqual(response.json()['data'][0]['message'], 'admin 登录')
+
     def test_wsgi(self):
         ''' wsgi '''
         from . import wsgi
@@ -39,3 +163,33 @@ class AppTests(TestCase):
         parse_list('test')
         with self.assertRaises(KeyError):
             parse_list(json.dumps({'data': [{'val': 1}]}), 'name')
+
+    def test_refcache(self):
+        ''' 测试进程内参考数据缓存按版本戳失效 '''
+        loads = []
+        cached = refcache.RefCache('test', lambda: loads.append(1) or len(loads))
+        self.assertEqual(cached.get(), 1)
+        self.assertEqual(cached.get(), 1)
+        stamp = refcache.read_stamp('test')
+        refcache.invalidate('test')
+        refcache.invalidate('test')
+        self.assertGreater(refcache.read_stamp('test'), stamp)
+        self.assertEqual(cached.get(), 2)
+
+        init_category()
+        root = AssetCategory.root()
+        with self.assertNumQueries(0):
+            self.assertEqual(AssetCategory.root(), root)
+            self.assertEqual(Department.root().name, '总公司')
+            self.assertEqual(AssetCategory.get_by_name('电子设备').parent_id, root.id)
+        root = Department.root()
+        root.name = '改名'  # 返回的是副本，不影响缓存
+        self.assertEqual(Department.root().name, '总公司')
+        self.assertTrue(os.path.isfile(refcache.stamp_path('test')))
+        self.assertFalse(refcache.stamp_path('test').startswith(settings.BASE_DIR))
+        category = AssetCategory.get_by_name('电子设备')
+        category.name = '电子产品'
+        category.save()
+        self.assertEqual(AssetCategory.get_by_name('电子产品').id, category.id)
+        with self.assertRaises(AssetCategory.DoesNotExist):
+            AssetCategory.get_by_name('电子设备')
@@ -2,13 +2,18 @@
 app/utils Project 级别的 utils 函数
 utils文件下的函数一般不用特别测试
 '''
+import base64
+import binascii
 import json
 import logging
+import os
+import tempfile
 from collections import UserDict
 from functools import partial, wraps
 
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.http.response import JsonResponse
+from django.test import override_settings
 from django.test.testcases import TestCase
 from django.views.decorators.csrf import csrf_exempt
 
@@ -21,6 +26,13 @@ class EchoDict(UserDict):
 
 
 LOGGER = logging.getLogger('web.log')
+# 游标分页的默认页大小和最大页大小
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class ServiceUnavailable(Exception):
+    ''' 服务暂时不可用，catch_exception 返回 code=503 '''
 
 
 def gen_response(**data):
@@ -83,16 +95,43 @@ def parse_list(dic: str, *args, **default_args):
     return res_list
 
 
-def visit_tree(node):
+def encode_cursor(values: list) -> str:
+    ''' 将末行的排序键编码为不透明的游标 '''
+    raw = json.dumps(values, default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+
+def decode_cursor(cursor: str, length: int) -> list:
+    ''' encode_cursor 的逆过程，游标应是长度为 length 的列表 '''
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise KeyError('http 参数 cursor 不合法')
+    if not isinstance(values, list) or len(values) != length:
+        raise KeyError('http 参数 cursor 不合法')
+    return values
+
+
+def tree_to_dict(nodes) -> dict:
     '''
-    transform a mptt to dict
+    将按 tree_id, lft 排序的 MPTT 节点 [(id, name, parent_id), ...] 转换为嵌套字典
+    return: 第一棵树的根节点 {name, id, children}
     '''
-    res = {'name': node.name, 'id': node.id, 'children': []}
-    if not node.is_leaf_node():
-        children = node.get_children()
-        for child in children:
-            res['children'].append(visit_tree(child))
-    return res
+    visited = {}
+    root = None
+    for nid, name, parent_id in nodes:
+        node = visited[nid] = {'name': name, 'id': nid, 'children': []}
+        if parent_id is None:
+            root = root or node
+        else:
+            visited[parent_id]['children'].append(node)
+    return root
+
+
+def load_tree_dict(model) -> dict:
+    ''' 一次有序查询得到 model 的树并转换为嵌套字典，缓存见各模型的 tree_dict '''
+    nodes = model.objects.order_by('tree_id', 'lft').values_list('id', 'name', 'parent_id')
+    return tree_to_dict(nodes)
 
 
 def catch_exception(*valid_http_methods):
@@ -104,6 +143,7 @@ def catch_exception(*valid_http_methods):
         - POST 请求体参数错误
         - 数据库对应表项不存在错误
         - 数据库表项格式错误
+        - 服务繁忙
 
     例:
     @catch_exception('GET')
@@ -135,6 +175,8 @@ def catch_exception(*valid_http_methods):
                 return error_response(message=f'指定的{en_to_sc[msg]}不存在', code=202)
             except ValidationError as err:  # 数据库格式错误
                 return error_response(message=str(err).replace('"', "'"), code=400)
+            except ServiceUnavailable as err:  # 服务繁忙，客户端应稍后重试
+                return error_response(message=str(err), code=503)
             return response
         return inner
     return decorator
@@ -144,6 +186,17 @@ def init_test(test: TestCase):
     ''' 在测试模块的setUp函数中调用，
     以初始化资源并登录admin '''
     from user.apps import add_admin, init_department
+    from app.refcache import invalidate_all
+    from user.utils import TOKENS
+    run_dir = tempfile.TemporaryDirectory()  # 版本戳和日志库不写入源码目录
+    test.addCleanup(run_dir.cleanup)
+    test_settings = override_settings(
+        REFCACHE_DIR=os.path.join(run_dir.name, 'refcache'),
+        LOG_STORE_PATH=os.path.join(run_dir.name, 'web-log.sqlite3'))
+    test_settings.enable()
+    test.addCleanup(test_settings.disable)
+    invalidate_all()
+    TOKENS.clear()
     init_department()
     add_admin()
     response = test.client.post('/api/user/login',
@@ -1,10 +1,13 @@
 '''
 Basic views
 '''
-import json
+from itertools import islice
+
+from django.conf import settings
 
 from user.utils import auth_permission_required
-from .settings import LOGS_FILE_DIR
+from .logreader import iter_logs
+from .logstore import connect, count_logs, first_log_time, flush_handlers, query_logs
 from .utils import catch_exception, gen_response, parse_args
 
 
@@ -12,14 +15,31 @@ from .utils import catch_exception, gen_response, parse_args
 @auth_permission_required()
 def get_logs(request):
     ''' api/logs POST
-    para: offset(int) = 0, size(int) = 20
-    return: data(str), code =
+    从新到旧返回日志，按条件从日志库的索引中查询，
+    早于日志库中最早记录的部分，以及未配置 LOG_STORE_PATH 时，读取日志文件，包括轮转出的旧日志
+    para: offset(int) = 0, size(int) = 20,
+        username(str), path(str) 前缀, method(str), start(str), end(str) 时间范围，均可选
+    return: data([{}]), code =
         200: success
     '''
-    offset, size = parse_args(request.body, 'offset', 'size', offset=0, size=20)
-    data = []
-    with open(LOGS_FILE_DIR, 'r', encoding='utf8') as logs_file:
-        logs = logs_file.readlines()[::-1]
-        data = logs[offset: (offset + size)]
-    data = [json.loads(line[:-1]) for line in data]
+    offset, size, username, path, method, start, end = parse_args(
+        request.body, 'offset', 'size', 'username', 'path', 'method', 'start', 'end',
+        offset=0, size=20, username='', path='', method='', start='', end='')
+    if not isinstance(offset, int) or not isinstance(size, int) or offset < 0 or size < 0:
+        raise KeyError('http 参数 offset 或 size 不合法')
+    conditions = (username, path, method, start, end)
+    data, first = [], ''
+    if settings.LOG_STORE_PATH:
+        flush_handlers()
+        conn = connect()
+        try:
+            data = query_logs(conn, offset, size, *conditions)
+            if len(data) < size:  # 日志库建立之前的记录只在日志文件中
+                first = first_log_time(conn)
+                offset = max(offset - count_logs(conn, *conditions), 0)
+        finally:
+            conn.close()
+    if len(data) < size:
+        logs = iter_logs(*conditions, before=first)
+        data += islice(logs, offset, offset + size - len(data))
     return gen_response(code=200, data=data)
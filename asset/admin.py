@@ -1,14 +1,30 @@
 ''' asset/admin.py '''
 from django.contrib import admin
+from django.http import Http404
 from simple_history.admin import SimpleHistoryAdmin
 
-from .models import Asset, AssetCategory
+from .models import Asset, AssetCategory, AssetHistoryDelta, delta_history_enabled
 
 
 class AssetHistoryAdmin(SimpleHistoryAdmin):
     ''' 将simple_history集成到Django Admin '''
     list_display = ['name', 'status', 'owner', 'history']
 
+    def render_history_view(self, request, template, context, **kwargs):
+        ''' 增量存储时，由增量记录还原出完整的历史记录来显示 '''
+        if delta_history_enabled():
+            obj = context['object']
+            context['action_list'] = [
+                Asset.history.model(id=obj.pk, **record)
+                for record in AssetHistoryDelta.get_records(obj.pk)]
+        return super().render_history_view(request, template, context, **kwargs)
+
+    def history_form_view(self, request, object_id, version_id, extra_context=None):
+        ''' 增量记录不在 simple_history 的表中，无法按记录回滚 '''
+        if delta_history_enabled():
+            raise Http404
+        return super().history_form_view(request, object_id, version_id, extra_context)
+
 
 admin.site.register(Asset, AssetHistoryAdmin)
 admin.site.register(AssetCategory)
@@ -0,0 +1,149 @@
+'''
+批量导入资产
+
+每批行数据一次性解析类别和父资产，逐行只做字段校验，
+随后 bulk_create 写入，并在内存中重建受影响的资产树，
+历史记录和自定义属性同样批量写入。
+'''
+import csv
+import io
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .models import Asset, AssetCategory, AssetCustomAttr, CustomAttr
+
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FIELDS = ('name', 'value', 'category', 'description', 'service_life', 'parent_id')
+IMPORT_DEFAULTS = {'description': '', 'service_life': 5, 'parent_id': ''}
+MPTT_FIELDS = ['parent', 'tree_id', 'lft', 'rght', 'level']
+
+
+def iter_csv_rows(upload):
+    '''
+    逐行读取上传的 CSV 文件，不整体读入内存
+    表头为 IMPORT_FIELDS，其余与自定义属性同名的列作为自定义属性
+    '''
+    keys = set(CustomAttr.get_keys())
+    reader = csv.DictReader(io.TextIOWrapper(upload.file, encoding='utf-8-sig'))
+    for row in reader:
+        row['custom'] = {key: value for key, value in row.items() if key in keys}
+        yield row
+
+
+def clean_row(row: dict, categories: dict, parents: dict) -> tuple:
+    ''' 校验一行数据，出错时抛出 ValidationError
+    return: (未保存的资产, 父资产或 None) '''
+    values = {**IMPORT_DEFAULTS, **{key: val for key, val in row.items() if val is not None}}
+    missing = [field for field in IMPORT_FIELDS if field not in values]
+    if missing:
+        raise ValidationError(f'缺少字段 {",".join(missing)}')
+    if not isinstance(values.get('custom', {}), dict):
+        raise ValidationError('自定义属性 custom 应为对象')
+    if values['category'] not in categories:
+        raise ValidationError(f'资产类别 {values["category"]} 不存在')
+    parent_id = values['parent_id']
+    parent = None
+    if parent_id not in ('', -1, '-1'):
+        try:
+            parent = parents[int(parent_id)]
+        except (KeyError, ValueError):
+            raise ValidationError(f'父资产 {parent_id} 不存在')
+        if parent.status != 'IDLE':
+            raise ValidationError('只能指定空闲资产为父资产')
+    asset = Asset(name=values['name'], value=values['value'],
+                  description=values['description'], service_life=values['service_life'],
+                  category_id=categories[values['category']], status='IDLE')
+    asset.clean_fields(exclude=['owner', 'category'] + MPTT_FIELDS)
+    return asset, parent
+
+
+def lock_tree_ids() -> int:
+    '''
+    锁住资产表的 tree_id 分配直到事务结束，其他事务不会在此期间占用新的 tree_id
+    PostgreSQL 锁表，其余支持 select_for_update 的数据库锁住 tree_id 最大的行，
+    SQLite 以一次空的 UPDATE 提前取得数据库的写锁
+    return: 当前最大的 tree_id
+    '''
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            table = connection.ops.quote_name(Asset._meta.db_table)
+            cursor.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+    elif not connection.features.has_select_for_update:
+        Asset.objects.filter(tree_id=0).update(tree_id=0)
+    last = (Asset.objects.select_for_update().order_by('-tree_id')
+            .values_list('tree_id', flat=True).first())
+    return last or 0
+
+
+def import_batch(rows: list, owner, errors: list, children: list) -> int:
+    '''
+    导入一批 (行号, 行数据)，错误追加到 errors
+    有父资产的资产先按独立的树编号写入，并追加到 children，留待最后统一挂入父资产的树
+    return: 成功导入的资产数
+    '''
+    for line, row in rows:
+        if not isinstance(row, dict):
+            errors.append({'row': line, 'message': '行数据应为对象'})
+    rows = [(line, row) for line, row in rows if isinstance(row, dict)]
+    names = {row.get('category') for _, row in rows}
+    categories = dict(AssetCategory.objects.filter(name__in=names).values_list('name', 'id'))
+    parent_ids = set()
+    for _, row in rows:
+        try:
+            parent_ids.add(int(row.get('parent_id')))
+        except (TypeError, ValueError):
+            pass
+    parents = Asset.objects.only('id', 'status', 'tree_id').in_bulk(parent_ids)
+
+    assets, customs = [], []
+    for line, row in rows:
+        try:
+            asset, parent = clean_row(row, categories, parents)
+        except ValidationError as err:
+            errors.append({'row': line, 'message': '; '.join(err.messages)})
+            continue
+        assets.append(asset)
+        customs.append(row.get('custom') or {})
+        if parent is not None:
+            asset.parent = parent
+            children.append(asset)
+    if not assets:
+        return 0
+
+    # 每个资产先各自成为一棵新树，数据库不返回主键时以 tree_id 找回 bulk_create 后的主键
+    base = lock_tree_ids() + 1
+    for offset, asset in enumerate(assets):
+        asset.owner = owner
+        asset.tree_id, asset.lft, asset.rght, asset.level = base + offset, 1, 2, 0
+    Asset.objects.bulk_create(assets)
+    if not connection.features.can_return_ids_from_bulk_insert:
+        ids = dict(Asset.objects.filter(tree_id__gte=base, tree_id__lt=base + len(assets))
+                   .values_list('tree_id', 'id'))
+        for asset in assets:
+            asset.id = ids[asset.tree_id]
+
+    Asset.record_history(assets, '+')
+    AssetCustomAttr.update_custom_attrs_bulk({asset.id: custom
+                                              for asset, custom in zip(assets, customs)})
+    return len(assets)
+
+
+def import_assets(rows, owner) -> tuple:
+    '''
+    在一个事务中分批导入资产，挂账人为 owner
+    rows: 可迭代的行数据字典，字段见 IMPORT_FIELDS，custom 为自定义属性字典
+    return: (导入数, 错误列表 [{row(int) 行号, message(str)}])
+    '''
+    errors, children = [], []
+    created = 0
+    rows = enumerate(rows, 1)
+    with transaction.atomic():
+        batch = list(islice(rows, IMPORT_BATCH_SIZE))
+        while batch:
+            created += import_batch(batch, owner, errors, children)
+            batch = list(islice(rows, IMPORT_BATCH_SIZE))
+        if children:  # 统一挂入父资产所在的树，只重建这些树
+            Asset.rebuild_trees({asset.parent.tree_id for asset in children}, children)
+    return created, errors
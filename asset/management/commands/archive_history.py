@@ -0,0 +1,31 @@
+''' 归档资产历史记录 python manage.py archive_history [--days N] [--loop] '''
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from asset.utils import ARCHIVE_CHUNK_SIZE, archive_history
+
+
+class Command(BaseCommand):
+    ''' 将早于若干天的资产历史记录移入归档表 '''
+    help = '将早于 --days 天的资产历史记录移入归档表，--loop 时每隔 --interval 秒执行一次'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.HISTORY_ARCHIVE_DAYS,
+                            help='归档早于多少天的记录')
+        parser.add_argument('--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE,
+                            help='每个事务归档的记录数')
+        parser.add_argument('--loop', action='store_true', help='常驻，定期归档')
+        parser.add_argument('--interval', type=int, default=settings.HISTORY_ARCHIVE_INTERVAL,
+                            help='--loop 时两次归档间隔的秒数')
+
+    def handle(self, *args, **options):
+        while True:
+            cutoff = datetime.now() - timedelta(days=options['days'])
+            archived = archive_history(cutoff, options['chunk_size'])
+            self.stdout.write(f'归档了 {archived} 条 {cutoff:%Y-%m-%d %H:%M:%S} 之前的历史记录')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+''' 将完整的资产历史记录转换为增量记录 python manage.py compact_history [--delete] '''
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from asset.models import HISTORY_FIELDS, Asset, AssetHistoryDelta
+
+META_FIELDS = ['history_date', 'history_type', 'history_change_reason', 'history_user_id']
+
+
+class Command(BaseCommand):
+    ''' 切换到 ASSET_HISTORY_BACKEND = 'delta' 前，转换已有的历史记录 '''
+    help = '将 simple_history 的完整记录转换为 AssetHistoryDelta 增量记录'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='每次写入的记录数')
+        parser.add_argument('--delete', action='store_true', help='转换后删除完整记录')
+
+    def handle(self, *args, **options):
+        records = (Asset.history.order_by('id', 'history_date', 'history_id')
+                   .values('id', *META_FIELDS, *HISTORY_FIELDS))
+        rows, converted = [], 0
+        asset_id, prev_state, depth = None, None, 0
+        with transaction.atomic():
+            for record in records.iterator():
+                if record['id'] != asset_id:
+                    asset_id, prev_state, depth = record['id'], None, 0
+                state = {field: record[field] for field in HISTORY_FIELDS}
+                depth, changes = AssetHistoryDelta.diff(prev_state, state, depth)
+                prev_state = state
+                rows.append(AssetHistoryDelta(asset_id=asset_id, depth=depth,
+                                              changes=json.dumps(changes, ensure_ascii=False),
+                                              **{field: record[field] for field in META_FIELDS}))
+                if len(rows) >= options['batch_size']:
+                    AssetHistoryDelta.objects.bulk_create(rows)
+                    converted, rows = converted + len(rows), []
+            AssetHistoryDelta.objects.bulk_create(rows)
+            converted += len(rows)
+            if options['delete']:
+                Asset.history.all().delete()
+        self.stdout.write(f'转换了 {converted} 条历史记录')
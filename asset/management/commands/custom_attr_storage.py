@@ -0,0 +1,67 @@
+''' 切换自定义属性的存储方式 python manage.py custom_attr_storage {eav,json} '''
+import json
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from asset import search
+from asset.models import CUSTOM_ATTR_PURGE_CHUNK, Asset, AssetCustomAttr, CustomAttr
+
+
+class Command(BaseCommand):
+    ''' 修改 settings.CUSTOM_ATTR_STORAGE 之前，将已有的属性值转换为新的存储方式 '''
+    help = '将自定义属性值转换到 AssetCustomAttr 表 (eav) 或 Asset.custom_attrs 列 (json)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('storage', choices=['eav', 'json'], help='目标存储方式')
+        parser.add_argument('--chunk-size', type=int, default=CUSTOM_ATTR_PURGE_CHUNK,
+                            help='每个事务转换的资产数')
+
+    def handle(self, *args, **options):
+        keys = list(CustomAttr.objects.values_list('name', flat=True))
+        chunk_size = options['chunk_size']
+        assets = Asset.objects.order_by('id').only('id', 'custom_attrs')
+        converted, last_id = 0, 0
+        while True:
+            with transaction.atomic():
+                chunk = list(assets.filter(id__gt=last_id).select_for_update()[:chunk_size])
+                if not chunk:
+                    break
+                if options['storage'] == 'json':
+                    self.to_json(chunk, keys)
+                else:
+                    self.to_eav(chunk, keys)
+            converted, last_id = converted + len(chunk), chunk[-1].id
+
+        for key in CustomAttr.all_objects.values_list('name', flat=True):
+            if options['storage'] == 'json' and key in keys:
+                search.create_json_attr_index(key)
+            else:
+                search.drop_json_attr_index(key)
+        self.stdout.write(f'转换了 {converted} 个资产的自定义属性，'
+                          f"请将 CUSTOM_ATTR_STORAGE 设为 '{options['storage']}' 并重启服务")
+
+    @staticmethod
+    def to_json(chunk: list, keys: list):
+        ''' AssetCustomAttr -> Asset.custom_attrs，转换后删除这些资产的 AssetCustomAttr '''
+        values = AssetCustomAttr.objects.filter(asset_id__in=[asset.id for asset in chunk])
+        attrs = defaultdict(dict)
+        for asset_id, key, value in (values.filter(key_id__in=keys)
+                                     .values_list('asset_id', 'key_id', 'value')):
+            attrs[asset_id][key] = value
+        for asset in chunk:
+            asset.custom_attrs = json.dumps(attrs[asset.id], ensure_ascii=False)
+        Asset.objects.bulk_update(chunk, ['custom_attrs'])
+        values.delete()
+
+    @staticmethod
+    def to_eav(chunk: list, keys: list):
+        ''' Asset.custom_attrs -> AssetCustomAttr，替换这些资产已有的属性值 '''
+        AssetCustomAttr.objects.filter(asset_id__in=[asset.id for asset in chunk]).delete()
+        rows = []
+        for asset in chunk:
+            attrs = json.loads(asset.custom_attrs)
+            rows += [AssetCustomAttr(asset_id=asset.id, key_id=key, value=attrs[key])
+                     for key in keys if key in attrs]
+        AssetCustomAttr.objects.bulk_create(rows)
@@ -0,0 +1,27 @@
+''' 清理被删除的自定义属性 python manage.py purge_custom_attrs [--loop] '''
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from asset.models import CUSTOM_ATTR_PURGE_CHUNK, CustomAttr
+
+
+class Command(BaseCommand):
+    ''' 分批删除被标记删除的自定义属性及其属性值 '''
+    help = '删除被标记删除的自定义属性的属性值，--loop 时每隔 --interval 秒执行一次'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CUSTOM_ATTR_PURGE_CHUNK,
+                            help='每个事务删除的属性值数')
+        parser.add_argument('--loop', action='store_true', help='常驻，定期清理')
+        parser.add_argument('--interval', type=int, default=settings.CUSTOM_ATTR_PURGE_INTERVAL,
+                            help='--loop 时两次清理间隔的秒数')
+
+    def handle(self, *args, **options):
+        while True:
+            purged = CustomAttr.purge_dropped(options['chunk_size'])
+            self.stdout.write(f'删除了 {purged} 个被删除属性的属性值')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
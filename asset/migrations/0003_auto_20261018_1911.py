@@ -0,0 +1,17 @@
+# Generated by Django 2.2.4 on 2026-10-18 19:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0002_auto_20201113_1550'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='asset',
+            index=models.Index(fields=['owner', 'status', 'id'], name='asset_asset_owner_i_f932dd_idx'),
+        ),
+    ]
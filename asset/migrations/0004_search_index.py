@@ -0,0 +1,77 @@
+# 资产名称、简介和自定义属性值的全文索引
+# SQLite 使用 FTS5 trigram 外部内容表，由触发器增量维护；
+# PostgreSQL 使用 pg_trgm GIN 索引，直接服务于 LIKE '%...%' 查询。
+
+from django.db import migrations, transaction
+from django.db.utils import OperationalError
+
+
+def fts_table_sql(table, columns):
+    ''' 建立 table 的 FTS5 外部内容表和同步触发器 '''
+    fts = f'{table}_fts'
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{col}' for col in columns)
+    old = ', '.join(f'old.{col}' for col in columns)
+    return [
+        f"CREATE VIRTUAL TABLE {fts} USING fts5({cols}, content='{table}', "
+        f"content_rowid='id', tokenize='trigram')",
+        f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+
+
+SEARCH_TABLES = {
+    'asset_asset': ['name', 'description'],
+    'asset_assetcustomattr': ['value'],
+}
+
+
+def create_search_index(apps, schema_editor):
+    ''' 按数据库类型建立索引，不支持的数据库保持 LIKE 查询 '''
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            with transaction.atomic(), schema_editor.connection.cursor() as cursor:
+                cursor.execute("CREATE VIRTUAL TABLE temp.fts_probe USING fts5(x, tokenize='trigram')")
+                cursor.execute('DROP TABLE temp.fts_probe')
+        except OperationalError:  # SQLite < 3.34 没有 trigram 分词器
+            return
+        for table, columns in SEARCH_TABLES.items():
+            for sql in fts_table_sql(table, columns):
+                schema_editor.execute(sql)
+    elif vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for table, columns in SEARCH_TABLES.items():
+            for col in columns:
+                schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {table}_{col}_trgm '
+                                      f'ON {table} USING gin ({col} gin_trgm_ops)')
+
+
+def drop_search_index(apps, schema_editor):
+    ''' create_search_index 的逆操作 '''
+    vendor = schema_editor.connection.vendor
+    for table, columns in SEARCH_TABLES.items():
+        if vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                schema_editor.execute(f'DROP TRIGGER IF EXISTS {table}_fts_{suffix}')
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+        elif vendor == 'postgresql':
+            for col in columns:
+                schema_editor.execute(f'DROP INDEX IF EXISTS {table}_{col}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0003_auto_20261018_1911'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.4 on 2026-10-18 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0004_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAssetHistory',
+            fields=[
+                ('history_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('asset_id', models.IntegerField(verbose_name='资产id')),
+                ('history_date', models.DateTimeField()),
+                ('history_type', models.CharField(max_length=1)),
+                ('history_change_reason', models.CharField(max_length=100, null=True)),
+                ('history_user_id', models.CharField(max_length=30, null=True, verbose_name='修改人')),
+                ('name', models.CharField(max_length=30, verbose_name='资产名称')),
+                ('description', models.CharField(max_length=150, verbose_name='简介')),
+                ('parent_id', models.IntegerField(null=True, verbose_name='父资产id')),
+                ('status', models.CharField(max_length=20)),
+                ('owner_id', models.CharField(max_length=30, null=True, verbose_name='挂账人')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedassethistory',
+            index=models.Index(fields=['asset_id', 'history_date'], name='asset_archi_asset_i_37dded_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.4 on 2026-10-18 19:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0005_auto_20261018_1924'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetHistoryDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('asset_id', models.IntegerField(verbose_name='资产id')),
+                ('history_date', models.DateTimeField()),
+                ('history_type', models.CharField(max_length=1)),
+                ('history_change_reason', models.CharField(max_length=100, null=True)),
+                ('history_user_id', models.CharField(max_length=30, null=True, verbose_name='修改人')),
+                ('depth', models.IntegerField(default=0, verbose_name='距上一个快照的记录数')),
+                ('changes', models.TextField(verbose_name='变化的字段')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='assethistorydelta',
+            index=models.Index(fields=['asset_id', 'id'], name='asset_asset_asset_i_24296c_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# 按时间点还原资产状态时，按资产分组取某时刻之前最新的历史记录，见 asset.utils.iter_snapshot
+# 历史模型由 simple_history 生成，索引只建在数据库中，不改变模型状态
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0006_history_delta'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX asset_historicalasset_snapshot_idx '
+            'ON asset_historicalasset (id, history_date, history_id)',
+            'DROP INDEX asset_historicalasset_snapshot_idx',
+        ),
+    ]
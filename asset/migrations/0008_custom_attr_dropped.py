@@ -0,0 +1,18 @@
+# Generated by Django 2.2.4 on 2026-10-18 19:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0007_history_snapshot_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customattr',
+            name='dropped',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 2.2.4 on 2026-10-18 19:35
+# 自定义属性的 JSON 列存储，见 settings.CUSTOM_ATTR_STORAGE
+# 已有属性值的转换和表达式索引由 manage.py custom_attr_storage 完成
+# SQLite 上 AddField 会重建 asset_asset 表，需要恢复全文索引的触发器
+
+from django.db import migrations, models
+
+FTS = 'asset_asset_fts'
+FTS_TRIGGERS = {
+    'ai': f"CREATE TRIGGER {FTS}_ai AFTER INSERT ON asset_asset BEGIN "
+          f"INSERT INTO {FTS}(rowid, name, description) "
+          f"VALUES (new.id, new.name, new.description); END",
+    'ad': f"CREATE TRIGGER {FTS}_ad AFTER DELETE ON asset_asset BEGIN "
+          f"INSERT INTO {FTS}({FTS}, rowid, name, description) "
+          f"VALUES ('delete', old.id, old.name, old.description); END",
+    'au': f"CREATE TRIGGER {FTS}_au AFTER UPDATE OF name, description ON asset_asset BEGIN "
+          f"INSERT INTO {FTS}({FTS}, rowid, name, description) "
+          f"VALUES ('delete', old.id, old.name, old.description); "
+          f"INSERT INTO {FTS}(rowid, name, description) "
+          f"VALUES (new.id, new.name, new.description); END",
+}
+
+
+def restore_triggers(apps, schema_editor):
+    ''' 增删 custom_attrs 字段后恢复 asset_asset 的全文索引触发器，并重新建立索引 '''
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or FTS not in connection.introspection.table_names():
+        return
+    for suffix, sql in FTS_TRIGGERS.items():
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {FTS}_{suffix}')
+        schema_editor.execute(sql)
+    schema_editor.execute(f"INSERT INTO {FTS}({FTS}) VALUES ('rebuild')")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0008_custom_attr_dropped'),
+    ]
+
+    operations = [
+        # 回滚时 RemoveField 之后执行
+        migrations.RunPython(migrations.RunPython.noop, restore_triggers),
+        migrations.AddField(
+            model_name='asset',
+            name='custom_attrs',
+            field=models.TextField(default='{}', verbose_name='自定义属性'),
+        ),
+        migrations.RunPython(restore_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# 增量存储的历史按时间点还原时，按资产分组取某时刻之前最新的记录，见 asset.utils.iter_delta_snapshot
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('asset', '0009_asset_custom_attrs'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='assethistorydelta',
+            index=models.Index(fields=['asset_id', 'history_date'],
+                               name='asset_asset_asset_i_7297ce_idx'),
+        ),
+    ]
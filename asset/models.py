@@ -1,13 +1,51 @@
 '''asset model'''
-import queue
+import json
+import operator
+from collections import defaultdict
 from datetime import datetime
+from functools import reduce
 
-from django.db import models
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import OuterRef, Q, Subquery
+from django.db.models.query_utils import DeferredAttribute
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from mptt.models import MPTTModel, TreeForeignKey
 from simple_history.models import HistoricalRecords
+from simple_history.utils import get_change_reason_from_object
 
+from app.refcache import RefCache, copy_instance, invalidate
+from app.utils import load_tree_dict
 from user.models import User
 from department.models import Department
+from . import search
+
+# 历史记录中会变化的字段的 attname
+HISTORY_FIELDS = ('name', 'description', 'parent_id', 'status', 'owner_id')
+CUSTOM_ATTR_PURGE_CHUNK = 1000
+
+
+def delta_history_enabled() -> bool:
+    ''' 资产历史是否以增量形式存储，见 AssetHistoryDelta '''
+    return settings.ASSET_HISTORY_BACKEND == 'delta'
+
+
+def json_custom_attrs_enabled() -> bool:
+    ''' 自定义属性是否存放在 Asset.custom_attrs 列中，而不是 AssetCustomAttr 表中 '''
+    return settings.CUSTOM_ATTR_STORAGE == 'json'
+
+
+class AssetHistoricalRecords(HistoricalRecords):
+    ''' 增量存储时，单个资产的保存和删除写入 AssetHistoryDelta 而不是完整记录 '''
+
+    def create_historical_record(self, instance, history_type, using=None):
+        if delta_history_enabled():
+            AssetHistoryDelta.record([instance], history_type,
+                                     get_change_reason_from_object(instance))
+        else:
+            super().create_historical_record(instance, history_type, using)
 
 
 class AssetCategory(MPTTModel):
@@ -19,7 +57,27 @@ class AssetCategory(MPTTModel):
     @classmethod
     def root(cls):
         ''' 返回顶层类型 '''
-        return cls.objects.first().get_root()
+        return copy_instance(next(iter(CATEGORIES.get().values())))
+
+    @classmethod
+    def get_by_name(cls, name: str):
+        ''' 按名称取得资产类型，不存在时抛出 DoesNotExist，结果来自进程内缓存 '''
+        try:
+            category = CATEGORIES.get()[name]
+        except KeyError:
+            raise cls.DoesNotExist('AssetCategory matching query does not exist.')
+        return copy_instance(category)
+
+    @classmethod
+    def tree_dict(cls) -> dict:
+        ''' 资产类别树的嵌套字典，结果来自进程内缓存，不应被修改 '''
+        return CATEGORY_TREE.get()
+
+
+# 按树的顺序排列，第一个即顶层类型
+CATEGORIES = RefCache('asset_category', lambda: {
+    category.name: category for category in AssetCategory.objects.order_by('tree_id', 'lft')})
+CATEGORY_TREE = RefCache('asset_category', lambda: load_tree_dict(AssetCategory))
 
 
 class Asset(MPTTModel):
@@ -45,42 +103,135 @@ class Asset(MPTTModel):
                                  on_delete=models.CASCADE, default=None)
     start_time = models.DateTimeField(verbose_name='录入时间', auto_now_add=True)
     service_life = models.IntegerField(verbose_name='使用年限', default=1)
+    # settings.CUSTOM_ATTR_STORAGE 为 'json' 时的自定义属性 {key: value}
+    custom_attrs = models.TextField(verbose_name='自定义属性', default='{}')
+
+    history = AssetHistoricalRecords(excluded_fields=['start_time', 'service_life',
+                                                      'category', 'value', 'custom_attrs',
+                                                      'lft', 'rght', 'level', 'tree_id', ])
+
+    class Meta:
+        # 部门资产列表按 挂账人-状态-id 过滤、排序和分页
+        indexes = [models.Index(fields=['owner', 'status', 'id'])]
 
-    history = HistoricalRecords(excluded_fields=['start_time', 'service_life',
-                                                 'category', 'value',
-                                                 'lft', 'rght', 'level', 'tree_id', ])
+    @classmethod
+    def record_history(cls, assets, history_type='~', change_reason=None):
+        ''' 批量写入历史记录，按 settings.ASSET_HISTORY_BACKEND 写入完整记录或增量记录 '''
+        if delta_history_enabled():
+            AssetHistoryDelta.record(assets, history_type, change_reason)
+        else:
+            cls.history.bulk_history_create(assets, update=history_type == '~',
+                                            default_change_reason=change_reason)
+
+    @classmethod
+    def get_tree_ids(cls, asset_ids) -> set:
+        ''' 一次查询得到一组资产所在的资产树，有资产不存在时抛出 DoesNotExist '''
+        asset_ids = {int(nid) for nid in asset_ids}
+        tree_ids = dict(cls.objects.filter(id__in=asset_ids).values_list('id', 'tree_id'))
+        if len(tree_ids) != len(asset_ids):
+            raise cls.DoesNotExist('Asset matching query does not exist.')
+        return set(tree_ids.values())
+
+    @classmethod
+    def rebuild_trees(cls, tree_ids, new_nodes=()):
+        '''
+        一次查询取出 tree_ids 中的资产树，在内存中重新编号，只写回变化的节点
+        new_nodes: 已设置 parent、要挂入这些树的资产，排在原有兄弟节点之后
+        '''
+        nodes = list(cls.objects.filter(tree_id__in=tree_ids))
+        old = {node.id: (node.parent_id, node.tree_id, node.lft, node.rght, node.level)
+               for node in nodes}
+        nodes += new_nodes
+        children = defaultdict(list)
+        for node in nodes:
+            children[node.parent_id].append(node)
+        for siblings in children.values():
+            siblings.sort(key=lambda node: (node.id not in old, node.lft, node.id))
+
+        for root in children[None]:  # 非递归的先序遍历，避免过深的资产树
+            counter, root.lft, root.level = 1, 1, 0
+            stack = [(root, iter(children[root.id]))]
+            while stack:
+                node, rest = stack[-1]
+                child = next(rest, None)
+                counter += 1
+                if child is None:
+                    node.rght = counter
+                    stack.pop()
+                else:
+                    child.tree_id, child.lft, child.level = root.tree_id, counter, node.level + 1
+                    stack.append((child, iter(children[child.id])))
+        changed = [node for node in nodes
+                   if old.get(node.id) != (node.parent_id, node.tree_id, node.lft,
+                                           node.rght, node.level)]
+        cls.objects.bulk_update(changed, ['parent', 'tree_id', 'lft', 'rght', 'level'])
 
     def get_entire_tree(self) -> list:
-        ''' 层次遍历 获得由资产父子关系定义的整棵资产树 '''
-        item_queue = queue.Queue()
-        res = []
-        item_queue.put(self.get_root())
-        while not item_queue.empty():
-            item: Asset = item_queue.get()
-            res.append(item)
-            if not item.is_leaf_node():
-                children = item.get_children()
-                for asset in children:
-                    item_queue.put(asset)
-        return res
+        ''' 一次查询获得由资产父子关系定义的整棵资产树，按层次遍历的顺序排列 '''
+        return Asset.get_entire_trees([self])[self.tree_id]
+
+    @classmethod
+    def get_entire_trees(cls, assets) -> dict:
+        '''
+        一次查询获得一组资产所在的全部资产树，同一棵树只取一次
+        return: {tree_id: [asset, ...]}，每棵树按层次遍历的顺序排列
+        '''
+        trees = defaultdict(list)
+        tree_ids = {asset.tree_id for asset in assets}
+        family = cls.objects.filter(tree_id__in=tree_ids).order_by('tree_id', 'level', 'lft')
+        for asset in family:
+            trees[asset.tree_id].append(asset)
+        return trees
+
+    @classmethod
+    def update_trees(cls, tree_ids, change_reason=None, **fields) -> dict:
+        '''
+        集合式更新整棵资产树：在一个事务中，用一条 UPDATE 更新 tree_ids 中所有资产的 fields，
+        并批量写入历史记录，修改原因为 change_reason，修改人取自当前请求
+        return: 更新后的资产树 {tree_id: [asset, ...]}，同 get_entire_trees
+        '''
+        with transaction.atomic():
+            family = cls.objects.filter(tree_id__in=tree_ids)
+            assets = list(family.order_by('tree_id', 'level', 'lft'))
+            family.update(**fields)
+            for asset in assets:
+                for field, value in fields.items():
+                    setattr(asset, field, value)
+            cls.record_history(assets, '~', change_reason)
+        trees = defaultdict(list)
+        for asset in assets:
+            trees[asset.tree_id].append(asset)
+        return trees
 
     def save(self, *args, tree_update=False, **kwargs):
         ''' 在某些属性变化时，改变资产相关的父子资产 '''
-        def do_update(asset: Asset):
-            asset.owner = self.owner
-            asset.status = self.status
-            asset._change_reason = self._change_reason
-            asset.save()
-
-        if tree_update:  # 层次遍历更新整棵资产树
-            tree_list = self.get_entire_tree()
-            for asset in tree_list:
-                do_update(asset)
+        if tree_update:  # 整棵资产树随本资产更新挂账人和状态
+            Asset.update_trees([self.tree_id], getattr(self, '_change_reason', None),
+                               owner=self.owner, status=self.status)
         else:
+            # custom_attrs 只由 AssetCustomAttr 单独写入，普通保存不写回实例上过期的值
+            # 未移动时由 MPTT 以 _get_user_field_names 填充 update_fields，不写回过期的树编号
+            old_parent_id = self._mptt_cached_fields.get('parent')
+            if (not self._state.adding and kwargs.get('update_fields') is None
+                    and old_parent_id is not DeferredAttribute
+                    and old_parent_id != self.parent_id):  # 移动后的树编号由 MPTT 重新计算
+                kwargs['update_fields'] = MOVE_FIELDS
             super().save(*args, **kwargs)
 
-    def to_dict(self):
-        ''' 将 Asset 对象按字段转换成字典 '''
+    def _get_user_field_names(self):
+        return [name for name in super()._get_user_field_names() if name != 'custom_attrs']
+
+    def to_dict(self, children: list = None, custom: dict = None):
+        ''' 将 Asset 对象按字段转换成字典
+
+        children, custom 可由批量查询预先给出，见 asset.utils.serialize_assets
+        '''
+        if children is None:
+            children_ = self.children_formated
+        else:
+            children_ = ','.join(str(child) for child in children) if children else '无'
+        if custom is None:
+            custom = AssetCustomAttr.get_custom_attrs(self)
         return {
             'nid': self.id,
             'name': self.name,
@@ -88,15 +239,15 @@ class Asset(MPTTModel):
             'now_value': self.now_value,
             'category': self.category.name,
             'description': self.description,
-            'parent_id': '' if self.parent is None else self.parent.id,
+            'parent_id': '' if self.parent_id is None else self.parent_id,
             'parent': self.parent_formated,
-            'children_': self.children_formated,
+            'children_': children_,
             'status': self.status,
             'owner': self.owner.username,
             'department': self.department.name,
             'start_time': self.start_time.strftime('%Y-%m-%d %H:%M:%S'),
             'service_life': self.service_life,
-            'custom': AssetCustomAttr.get_custom_attrs(self),
+            'custom': custom,
         }
 
     @property
@@ -135,21 +286,192 @@ class Asset(MPTTModel):
 
         如果本部门没有资产管理员，则自部门树向上遍历，直至顶层部门
         '''
-        departments = self.department.get_ancestors(ascending=True, include_self=True)
-        manager = None
-        for department in departments:  # 自部门树向上遍历
-            manager = department.get_asset_manager()
-            if manager is not None:
-                break
-        return manager
+        return Department.asset_manager_of(self.owner.department_id, inherit=True)
 
     def __str__(self) -> str:
         return f'{self.name}(id={self.id})'
 
 
+MOVE_FIELDS = [field.name for field in Asset._meta.concrete_fields
+               if not field.primary_key and field.name != 'custom_attrs']
+
+
+class ArchivedAssetHistory(models.Model):
+    ''' 归档的资产历史记录，只保留 asset.utils.gen_history 需要的字段，见 archive_history '''
+    history_id = models.IntegerField(primary_key=True)
+    asset_id = models.IntegerField(verbose_name='资产id')
+    history_date = models.DateTimeField()
+    history_type = models.CharField(max_length=1)
+    history_change_reason = models.CharField(max_length=100, null=True)
+    history_user_id = models.CharField(max_length=30, null=True, verbose_name='修改人')
+    name = models.CharField(max_length=30, verbose_name='资产名称')
+    description = models.CharField(max_length=150, verbose_name='简介')
+    parent_id = models.IntegerField(null=True, verbose_name='父资产id')
+    status = models.CharField(max_length=20)
+    owner_id = models.CharField(max_length=30, null=True, verbose_name='挂账人')
+
+    class Meta:
+        indexes = [models.Index(fields=['asset_id', 'history_date'])]
+
+
+class AssetHistoryDelta(models.Model):
+    '''
+    增量存储的资产历史记录，settings.ASSET_HISTORY_BACKEND 为 'delta' 时代替 Asset.history
+    changes 为与上一条记录相比变化的字段 {attname: 新值}，
+    每个资产的首条记录及此后每 HISTORY_SNAPSHOT_INTERVAL 条记录为包含全部字段的快照
+    '''
+    asset_id = models.IntegerField(verbose_name='资产id')
+    history_date = models.DateTimeField()
+    history_type = models.CharField(max_length=1)
+    history_change_reason = models.CharField(max_length=100, null=True)
+    history_user_id = models.CharField(max_length=30, null=True, verbose_name='修改人')
+    depth = models.IntegerField(default=0, verbose_name='距上一个快照的记录数')
+    changes = models.TextField(verbose_name='变化的字段')
+
+    class Meta:
+        # 按时间点还原时按资产分组取最新的记录，见 asset.utils.iter_delta_snapshot
+        indexes = [models.Index(fields=['asset_id', 'id']),
+                   models.Index(fields=['asset_id', 'history_date'])]
+
+    @classmethod
+    def diff(cls, prev_state: dict, state: dict, depth: int) -> tuple:
+        ''' 比较前后两个状态，depth 为上一条记录的 depth，无前一状态或到达快照间隔时记为快照
+        return: (depth, changes) '''
+        depth += 1
+        if prev_state is None or depth >= settings.HISTORY_SNAPSHOT_INTERVAL:
+            return 0, state
+        return depth, {field: value for field, value in state.items() if prev_state[field] != value}
+
+    @classmethod
+    def last_states(cls, asset_ids) -> dict:
+        '''
+        一次查询取出各资产自最近的快照以来的记录，重放得到已存储的最后状态
+        return: {asset_id: (最后一条记录的 depth, 状态)}
+        '''
+        snapshot = (cls.objects.filter(asset_id=OuterRef('asset_id'), depth=0)
+                    .order_by('-id').values('id')[:1])
+        rows = (cls.objects.filter(asset_id__in=asset_ids, id__gte=Subquery(snapshot))
+                .order_by('asset_id', 'id').values_list('asset_id', 'depth', 'changes'))
+        states = {}
+        for asset_id, depth, changes in rows:
+            state = {} if depth == 0 else states[asset_id][1]
+            states[asset_id] = (depth, {**state, **json.loads(changes)})
+        return states
+
+    @classmethod
+    def record(cls, assets, history_type: str, change_reason=None):
+        ''' 批量写入 assets 的增量记录，与已存储的最后状态比较，而不是与实例读出时的状态比较 '''
+        states = {}
+        if history_type != '+':
+            states = cls.last_states([asset.id for asset in assets])
+        history_date = timezone.now()
+        rows = []
+        for asset in assets:
+            state = {field: getattr(asset, field) for field in HISTORY_FIELDS}
+            depth, prev_state = states.get(asset.id, (0, None))
+            depth, changes = cls.diff(prev_state, state, depth)
+            user = Asset.history.model.get_default_history_user(asset)
+            rows.append(cls(asset_id=asset.id, history_date=history_date,
+                            history_type=history_type, history_change_reason=change_reason,
+                            history_user_id=None if user is None else user.pk,
+                            depth=depth, changes=json.dumps(changes, ensure_ascii=False)))
+        cls.objects.bulk_create(rows)
+
+    @classmethod
+    def get_records(cls, asset_id: int, offset: int = 0, limit: int = None) -> list:
+        '''
+        按时间倒序取出资产的第 offset 条起的 limit 条记录，还原为完整的记录
+        一次查询多取出至多 HISTORY_SNAPSHOT_INTERVAL 条更早的记录，从最近的快照开始重放
+        return: [{history_date, history_type, history_change_reason, history_user_id,
+                  *HISTORY_FIELDS, history_id}, ...]
+        '''
+        rows = (cls.objects.filter(asset_id=asset_id).order_by('-id')
+                .values('id', 'history_date', 'history_type', 'history_change_reason',
+                        'history_user_id', 'depth', 'changes'))
+        if limit is None:
+            records = list(rows[offset:])
+        else:
+            records = list(rows[offset:offset + limit + settings.HISTORY_SNAPSHOT_INTERVAL])
+        page = records if limit is None else records[:limit]
+        if not page:
+            return []
+        snapshot = len(page) - 1 + page[-1]['depth']
+        if snapshot >= len(records):  # 快照间隔调小前写入的记录
+            records += rows[offset + len(records):offset + snapshot + 1]
+        state = {}
+        for record in reversed(records[:snapshot + 1]):
+            if record['depth'] == 0:
+                state = {}
+            state.update(json.loads(record.pop('changes')))
+            record.update(state, history_id=record.pop('id'))
+            del record['depth']
+        return page
+
+
+class CustomAttrManager(models.Manager):
+    ''' 只包括未被删除的自定义属性 '''
+
+    def get_queryset(self):
+        return super().get_queryset().filter(dropped=False)
+
+
 class CustomAttr(models.Model):
     ''' custom defined attribute '''
     name = models.CharField(max_length=20, verbose_name='属性名', primary_key=True)
+    # 删除属性时先做标记，属性值由 purge_dropped 分批删除，见 purge_custom_attrs 命令
+    dropped = models.BooleanField(default=False)
+
+    objects = CustomAttrManager()
+    all_objects = models.Manager()
+
+    @classmethod
+    def get_keys(cls) -> tuple:
+        ''' 全部自定义属性名，结果来自进程内缓存 '''
+        return CUSTOM_KEYS.get()
+
+    @classmethod
+    def set_attrs(cls, names: list):
+        '''
+        在一个事务中将自定义属性改为 names，只增删变化的属性，已有的属性值不受影响
+        被删除的属性只做标记，其属性值由 python manage.py purge_custom_attrs 删除
+        '''
+        with transaction.atomic():
+            old = set(cls.all_objects.values_list('name', flat=True))
+            dropped = set(cls.all_objects.filter(dropped=True).values_list('name', flat=True))
+            # 重新加入尚未清理完的属性时，同步清除其旧值
+            revived = dropped.intersection(names)
+            AssetCustomAttr.objects.filter(key__in=revived).delete()
+            if json_custom_attrs_enabled():
+                AssetCustomAttr.purge_json_keys(revived)
+            cls.all_objects.filter(name__in=revived).update(dropped=False)
+            added = [name for name in names if name not in old]
+            cls.objects.bulk_create(cls(name=name) for name in added)
+            if json_custom_attrs_enabled():
+                for name in added:
+                    search.create_json_attr_index(name)
+            invalidate('custom_attr')  # bulk_create 和 update 不发送信号
+            cls.objects.exclude(name__in=names).update(dropped=True)
+
+    @classmethod
+    def purge_dropped(cls, chunk_size: int = CUSTOM_ATTR_PURGE_CHUNK) -> int:
+        '''
+        分批删除被标记删除的属性的属性值，每批一个短事务，避免长时间锁表，最后删除属性本身
+        return: 删除的属性值数
+        '''
+        values = AssetCustomAttr.objects.filter(key__dropped=True)
+        purged = 0
+        while True:
+            ids = list(values.values_list('id', flat=True)[:chunk_size])
+            if not ids:
+                break
+            purged += AssetCustomAttr.objects.filter(id__in=ids).delete()[0]
+        keys = list(cls.all_objects.filter(dropped=True).values_list('name', flat=True))
+        if json_custom_attrs_enabled():
+            purged += AssetCustomAttr.purge_json_keys(keys, chunk_size)
+            for key in keys:
+                search.drop_json_attr_index(key)
+        cls.all_objects.filter(name__in=keys, dropped=True).delete()
+        return purged
 
 
 class AssetCustomAttr(models.Model):
@@ -158,39 +480,108 @@ class AssetCustomAttr(models.Model):
     key = models.ForeignKey(CustomAttr, on_delete=models.CASCADE)
     value = models.CharField(max_length=100, verbose_name='属性值')
 
-    @classmethod
-    def get_custom_attr(cls, asset: Asset, key: CustomAttr) -> str:
-        ''' 得到asset的某个自定义属性key的值，如果没有，就创建一个空的 '''
-        try:
-            return cls.objects.get(key=key, asset=asset).value
-        except cls.DoesNotExist:
-            cls.objects.create(asset=asset, key=key, value='')
-            return ''
-
     @classmethod
     def get_custom_attrs(cls, asset: Asset) -> dict:
         ''' 得到asset的所有自定义属性 '''
-        keys = CustomAttr.objects.all()
-        res = {key.name: cls.get_custom_attr(asset, key) for key in keys}
+        return cls.get_custom_attrs_bulk([asset])[asset.id]
+
+    @classmethod
+    def get_custom_attrs_bulk(cls, assets) -> dict:
+        ''' 一次查询得到一组资产的所有自定义属性，只读，不会写入数据库
+        return: {asset_id: {key: value}}，缺失的属性值为空串 '''
+        keys = CustomAttr.get_keys()
+        if json_custom_attrs_enabled():
+            res = {}
+            for asset in assets:
+                attrs = json.loads(asset.custom_attrs)
+                res[asset.id] = {key: attrs.get(key, '') for key in keys}
+            return res
+        res = {asset.id: dict.fromkeys(keys, '') for asset in assets}
+        attrs = (cls.objects.filter(asset__in=list(res), key__in=keys)
+                 .values_list('asset_id', 'key_id', 'value'))
+        for asset_id, key, value in attrs:
+            res[asset_id][key] = value
         return res
 
     @classmethod
     def update_custom_attrs(cls, asset: Asset, kwargs: dict):
         ''' 更新 asset 的自定义属性 '''
-        keys = CustomAttr.objects.all()
-        for key in keys:
-            try:
-                attr = cls.objects.get(asset=asset, key=key)
-                attr.value = kwargs.get(key.name, '')
-                attr.save()
-            except cls.DoesNotExist:
-                cls.objects.create(asset=asset, key=key, value=kwargs.get(key.name, ''))
+        cls.update_custom_attrs_bulk({asset.id: kwargs})
+        if json_custom_attrs_enabled():
+            asset.refresh_from_db(fields=['custom_attrs'])
+
+    @classmethod
+    def update_custom_attrs_bulk(cls, customs: dict):
+        ''' 批量更新自定义属性
+        customs: {asset_id: {key: value}}，未给出的属性置为空串
+        '''
+        keys = CustomAttr.get_keys()
+        if json_custom_attrs_enabled():
+            Asset.objects.bulk_update(
+                [Asset(id=asset_id, custom_attrs=json.dumps(
+                    {key: kwargs.get(key, '') for key in keys}, ensure_ascii=False))
+                 for asset_id, kwargs in customs.items()], ['custom_attrs'])
+            return
+        existing = {(attr.asset_id, attr.key_id): attr
+                    for attr in cls.objects.filter(asset__in=list(customs))}
+        to_update, to_create = [], []
+        for asset_id, kwargs in customs.items():
+            for key in keys:
+                value = kwargs.get(key, '')
+                attr = existing.get((asset_id, key))
+                if attr is None:
+                    to_create.append(cls(asset_id=asset_id, key_id=key, value=value))
+                elif attr.value != value:
+                    attr.value = value
+                    to_update.append(attr)
+        with transaction.atomic():
+            cls.objects.bulk_update(to_update, ['value'])
+            cls.objects.bulk_create(to_create)
 
     @classmethod
     def search_custom_attr(cls, attr_name: str, key: str, assets):
         ''' 根据自定义属性名和关键词搜索 返回资产列表'''
-        attr = CustomAttr.objects.get(name=attr_name)
-        attrs = AssetCustomAttr.objects.filter(key=attr,
-                                               value__contains=key)
-        assets = assets.filter(assetcustomattr__in=attrs)
-        return assets
+        if attr_name not in CustomAttr.get_keys():
+            raise CustomAttr.DoesNotExist('CustomAttr matching query does not exist.')
+        if json_custom_attrs_enabled():
+            return search.search_json_attr(assets, attr_name, key)
+        return search.search_custom_attr(assets, attr_name, key)
+
+    @classmethod
+    def purge_json_keys(cls, keys, chunk_size: int = CUSTOM_ATTR_PURGE_CHUNK) -> int:
+        ''' 按 id 分批从 Asset.custom_attrs 中删除属性 keys，每批一个短事务
+        return: 删除的属性值数 '''
+        if not keys:
+            return 0
+        assets = Asset.objects.filter(reduce(
+            operator.or_, (Q(custom_attrs__contains=json.dumps(key, ensure_ascii=False) + ':')
+                           for key in keys))).order_by('id')
+        purged, last_id = 0, 0
+        while True:
+            with transaction.atomic():  # 锁住本批资产，避免覆盖并发写入的属性值
+                chunk = list(assets.filter(id__gt=last_id).select_for_update()
+                             .only('id', 'custom_attrs')[:chunk_size])
+                if not chunk:
+                    return purged
+                for asset in chunk:
+                    attrs = json.loads(asset.custom_attrs)
+                    purged += sum(attrs.pop(key, None) is not None for key in keys)
+                    asset.custom_attrs = json.dumps(attrs, ensure_ascii=False)
+                Asset.objects.bulk_update(chunk, ['custom_attrs'])
+            last_id = chunk[-1].id
+
+
+CUSTOM_KEYS = RefCache('custom_attr', lambda: tuple(
+    CustomAttr.objects.values_list('name', flat=True)))
+
+
+@receiver([post_save, post_delete], sender=AssetCategory)
+def invalidate_categories(**kwargs):
+    ''' 资产类别修改后使缓存失效 '''
+    invalidate('asset_category')
+
+
+@receiver([post_save, post_delete], sender=CustomAttr)
+def invalidate_custom_keys(**kwargs):
+    ''' 自定义属性修改后使缓存失效 '''
+    invalidate('custom_attr')
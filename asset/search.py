@@ -0,0 +1,134 @@
+'''
+资产全文检索
+
+索引由 migrations/0004_search_index 建立：
+SQLite 上为 FTS5 trigram 表，由触发器随 Asset、AssetCustomAttr 的写入增量维护；
+PostgreSQL 上为 pg_trgm GIN 索引，LIKE 查询本身即可走索引。
+没有 FTS5 表、维护它的触发器缺失或关键词过短时，退回普通的 LIKE 查询。
+SQLite 上修改 asset_asset 表的迁移会重建该表，触发器随之丢失，迁移中须自行恢复，见 0009。
+
+自定义属性存放在 Asset.custom_attrs JSON 列中时，每个属性一个表达式索引，
+查询使用与索引完全相同的表达式：PostgreSQL 上为 trigram 索引，SQLite 上扫描索引而非整表。
+'''
+import hashlib
+
+from django.db import connection
+from django.db.models import CharField
+from django.db.models.expressions import RawSQL
+
+from app.utils import LOGGER
+
+MIN_FTS_LENGTH = 3  # trigram 分词器无法匹配少于 3 个字符的关键词
+ASSET_FTS_SQL = 'SELECT rowid FROM asset_asset_fts WHERE asset_asset_fts MATCH %s'
+CUSTOM_ATTR_FTS_SQL = ('SELECT attr.asset_id FROM asset_assetcustomattr_fts AS fts '
+                       'JOIN asset_assetcustomattr AS attr ON attr.id = fts.rowid '
+                       'WHERE asset_assetcustomattr_fts MATCH %s AND attr.key_id = %s')
+
+FTS_TRIGGERS = [f'{table}_fts_{suffix}' for table in ('asset_asset', 'asset_assetcustomattr')
+                for suffix in ('ai', 'ad', 'au')]
+
+_FTS_ENABLED = {}
+
+
+def missing_fts_triggers() -> list:
+    ''' 缺失的全文索引触发器，缺失时索引不再随写入更新 '''
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")
+        existing = {name for name, in cursor.fetchall()}
+    return [name for name in FTS_TRIGGERS if name not in existing]
+
+
+def fts_enabled() -> bool:
+    ''' 当前数据库是否建有 FTS5 索引表及维护它的全部触发器，结果按数据库缓存 '''
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _FTS_ENABLED:
+        enabled = 'asset_asset_fts' in connection.introspection.table_names()
+        missing = missing_fts_triggers() if enabled else []
+        if missing:  # 索引已过期，退回 LIKE 查询以免漏掉结果
+            LOGGER.error(f'全文索引的触发器 {",".join(missing)} 缺失，检索退回 LIKE 查询')
+        _FTS_ENABLED[name] = enabled and not missing
+    return _FTS_ENABLED[name]
+
+
+def use_fts(keyword: str) -> bool:
+    ''' 关键词能否由 FTS5 索引回答 '''
+    return len(keyword) >= MIN_FTS_LENGTH and fts_enabled()
+
+
+def match_expr(column: str, keyword: str) -> str:
+    ''' 构造 FTS5 的 MATCH 表达式，关键词整体作为短语，即子串匹配 '''
+    keyword = keyword.replace('"', '""')
+    return f'{column} : "{keyword}"'
+
+
+def search_assets(assets, field: str, keyword: str):
+    ''' 按资产名称(name)或简介(description)包含关键词过滤资产 '''
+    if not keyword:
+        return assets
+    if use_fts(keyword):
+        return assets.filter(id__in=RawSQL(ASSET_FTS_SQL, [match_expr(field, keyword)]))
+    return assets.filter(**{f'{field}__contains': keyword})
+
+
+def search_custom_attr(assets, key: str, keyword: str):
+    ''' 按自定义属性 key 的值包含关键词过滤资产 '''
+    if use_fts(keyword):
+        params = [match_expr('value', keyword), key]
+        return assets.filter(id__in=RawSQL(CUSTOM_ATTR_FTS_SQL, params))
+    return assets.filter(assetcustomattr__key=key, assetcustomattr__value__contains=keyword)
+
+
+def json_attr_expr(key: str) -> str:
+    ''' 取出 custom_attrs 中属性 key 的值的 SQL 表达式，键直接写入 SQL 以便与索引表达式一致 '''
+    key = key.replace("'", "''")
+    if connection.vendor == 'postgresql':
+        return f"((custom_attrs::jsonb) ->> '{key}')"
+    return f"json_extract(custom_attrs, '$.\"{key}\"')"
+
+
+def json_attr_index(key: str) -> str:
+    ''' 属性 key 的表达式索引名 '''
+    return f'asset_custom_{hashlib.md5(key.encode()).hexdigest()[:12]}'
+
+
+def create_json_attr_index(key: str):
+    ''' 为属性 key 建立表达式索引，PostgreSQL 上为 trigram 索引，可直接服务于子串查询 '''
+    if '"' in key:  # JSON path 中无法表示
+        return
+    expr = json_attr_expr(key)
+    if connection.vendor == 'postgresql':
+        sql = f'CREATE INDEX IF NOT EXISTS {json_attr_index(key)} ON asset_asset ' \
+              f'USING gin ({expr} gin_trgm_ops)'
+    else:
+        sql = f'CREATE INDEX IF NOT EXISTS {json_attr_index(key)} ON asset_asset ({expr})'
+    with connection.cursor() as cursor:
+        cursor.execute(sql)
+
+
+def drop_json_attr_index(key: str):
+    ''' create_json_attr_index 的逆操作 '''
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP INDEX IF EXISTS {json_attr_index(key)}')
+
+
+def json_attr_index_exists(key: str) -> bool:
+    ''' SQLite 上属性 key 的表达式索引是否存在 '''
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = %s",
+                       [json_attr_index(key)])
+        return cursor.fetchone() is not None
+
+
+def search_json_attr(assets, key: str, keyword: str):
+    ''' 按 custom_attrs 中属性 key 的值包含关键词过滤资产 '''
+    expr = json_attr_expr(key)
+    if connection.vendor == 'sqlite' and json_attr_index_exists(key):
+        # 子串匹配用不上 B 树，但扫描表达式索引不必逐行解析 JSON
+        sql = (f'SELECT id FROM asset_asset INDEXED BY {json_attr_index(key)} '
+               f"WHERE {expr} LIKE %s ESCAPE '\\'")
+        pattern = f'%{connection.ops.prep_for_like_query(keyword)}%'
+        return assets.filter(id__in=RawSQL(sql, [pattern]))
+    value = RawSQL(expr, [], output_field=CharField())
+    return assets.annotate(custom_value=value).filter(custom_value__contains=keyword)
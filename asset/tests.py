@@ -1,12 +1,23 @@
 '''test for app asset'''
+import io
 import json
+from datetime import datetime, timedelta
 
-from django.test import TestCase
-from django.db import transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
 from simple_history.utils import update_change_reason
 
-from app.utils import init_test
-from asset.models import AssetCategory, Asset, CustomAttr
+from app.utils import encode_cursor, init_test
+from asset import search
+from asset.models import (ArchivedAssetHistory, AssetCategory, Asset, AssetCustomAttr,
+                          AssetHistoryDelta, CustomAttr)
+from asset.search import fts_enabled, search_assets
+from asset.utils import (CODE_TO_ZH, FIELD_TO_ZH, HISTORY_OP_TYPE, archive_history,
+                         get_assets_list, get_history_page)
+from user.models import User
 from user.apps import add_old_asset, init_department, init_category
 
 
@@ -91,6 +102,87 @@ class AssetTest(TestCase):
         self.assertEqual(response['code'], 200)
         self.assertListEqual(response['data'], ['流水线'])
 
+    def test_custom_attr_incremental(self):
+        ''' 测试修改自定义属性只增删变化的属性，被删除属性的值分批清理 '''
+        asset = Asset.objects.get(id=1)
+        AssetCustomAttr.update_custom_attrs(asset, {'自定义': '甲'})
+        CustomAttr.set_attrs(['自定义', '编号'])
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'自定义': '甲', '编号': ''})
+
+        CustomAttr.set_attrs(['编号'])
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'编号': ''})
+        self.assertTrue(AssetCustomAttr.objects.filter(key='自定义').exists())
+        # 清理前重新加入的属性不保留旧值
+        CustomAttr.set_attrs(['编号', '自定义'])
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'自定义': '', '编号': ''})
+
+        AssetCustomAttr.update_custom_attrs(asset, {'自定义': '乙', '编号': '001'})
+        CustomAttr.set_attrs(['编号'])
+        out = io.StringIO()
+        call_command('purge_custom_attrs', '--chunk-size', '1', stdout=out)
+        self.assertIn('删除了 1 个', out.getvalue())
+        self.assertFalse(CustomAttr.all_objects.filter(name='自定义').exists())
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'编号': '001'})
+
+    def test_save_stale_instance(self):
+        ''' 测试保存过期的实例不写回过期的树编号，移动资产时照常更新 '''
+        stale = Asset.objects.get(id=1)
+        child = Asset.objects.create(name='子资产', parent=Asset.objects.get(id=1),
+                                     owner=stale.owner, category=stale.category)
+        stale.name = '改名'
+        stale.save()
+        root = Asset.objects.get(id=1)
+        self.assertEqual((root.name, root.lft, root.rght), ('改名', 1, 4))
+        child.refresh_from_db()
+        self.assertEqual((child.lft, child.rght), (2, 3))
+
+        child.parent = None
+        child.save()
+        root.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((root.rght, child.parent_id, child.lft, child.rght), (2, None, 1, 2))
+        self.assertNotEqual(child.tree_id, root.tree_id)
+
+    def test_custom_attrs_json(self):
+        ''' 测试存放在 Asset.custom_attrs 列中的自定义属性 '''
+        asset = Asset.objects.get(id=1)
+        CustomAttr.set_attrs(['自定义', '编号'])
+        AssetCustomAttr.update_custom_attrs(asset, {'编号': 'SN-1'})
+        call_command('custom_attr_storage', 'json', stdout=io.StringIO())
+        with self.settings(CUSTOM_ATTR_STORAGE='json'):
+            self.assertDictEqual(AssetCustomAttr.get_custom_attrs(Asset.objects.get(id=1)),
+                                 {'自定义': '', '编号': 'SN-1'})
+            self.check_custom_attrs_json()
+        call_command('custom_attr_storage', 'eav', stdout=io.StringIO())
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'自定义': ''})
+
+    def check_custom_attrs_json(self):
+        ''' test_custom_attrs_json 在 json 存储下的部分 '''
+        asset = Asset.objects.get(id=1)
+        stale = Asset.objects.get(id=1)
+        AssetCustomAttr.update_custom_attrs(asset, {'编号': 'SN-12345'})
+        self.assertFalse(AssetCustomAttr.objects.exists())
+        self.assertDictEqual(json.loads(asset.custom_attrs), {'自定义': '', '编号': 'SN-12345'})
+        stale.description = '过期的实例'
+        stale.save()  # 不写回过期的 custom_attrs
+        asset.refresh_from_db()
+        self.assertDictEqual(json.loads(asset.custom_attrs), {'自定义': '', '编号': 'SN-12345'})
+        with self.assertNumQueries(0):  # 属性名来自进程内缓存
+            self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset),
+                                 {'自定义': '', '编号': 'SN-12345'})
+        assets = AssetCustomAttr.search_custom_attr('编号', '123', Asset.objects.all())
+        self.assertListEqual([asset.id for asset in assets], [1])
+        assets = AssetCustomAttr.search_custom_attr('自定义', '123', Asset.objects.all())
+        self.assertFalse(assets.exists())
+        assets = AssetCustomAttr.search_custom_attr('编号', '%', Asset.objects.all())
+        self.assertFalse(assets.exists())
+
+        CustomAttr.set_attrs(['自定义'])
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'自定义': ''})
+        self.assertEqual(CustomAttr.purge_dropped(), 1)
+        asset.refresh_from_db()
+        self.assertDictEqual(json.loads(asset.custom_attrs), {'自定义': ''})
+
     def test_asset_available(self):
         ''' 测试获取可领用资产列表 asset/avaliable '''
         response = self.client.get('/api/asset/available').json()
@@ -219,3 +311,434 @@ class AssetTest(TestCase):
         response = self.client.post(path, json.dumps(paras),
                                     content_type='json')
         self.assertEqual(response.json()['code'], 200)
+
+        # 同一资产树只调拨一次
+        root = Asset.objects.get(id=1)
+        child = Asset.objects.create(name='子资产', parent=root, owner=root.owner,
+                                     category=root.category)
+        paras['idList'] = [1, child.id]
+        response = self.client.post(path, json.dumps(paras),
+                                    content_type='json').json()
+        self.assertListEqual(response['data'], [{'root': str(root), 'count': 2}])
+        self.assertEqual(Asset.history.filter(history_change_reason='调拨').count(), 3)
+
+        paras['idList'] = [1, 100]
+        response = self.client.post(path, json.dumps(paras),
+                                    content_type='json')
+        self.assertEqual(response.json()['code'], 202)
+
+    def test_assets_list_queries(self):
+        ''' 测试批量序列化资产列表的查询次数不随资产数量增长 '''
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                res = get_assets_list(Asset.objects.all())
+            return len(context), res
+
+        count_queries()  # 预热进程内的参考数据缓存
+        few, _ = count_queries()
+        old = Asset.objects.get(id=1)
+        for i in range(10):
+            Asset.objects.create(name=f'子资产{i}', parent=old, owner=old.owner,
+                                 category=old.category)
+        many, res = count_queries()
+        self.assertEqual(few, many)
+        self.assertEqual(len(res), 11)
+        self.assertEqual(res[0], old.to_dict())
+        self.assertEqual(res[1]['parent'], str(old))
+
+    def test_custom_attrs_bulk(self):
+        ''' 测试自定义属性的只读批量加载和批量更新 '''
+        asset = Asset.objects.get(id=1)
+        CustomAttr.objects.create(name='编号')
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs(asset), {'自定义': '', '编号': ''})
+        self.assertFalse(AssetCustomAttr.objects.exists())
+
+        AssetCustomAttr.update_custom_attrs(asset, {'编号': '001'})
+        AssetCustomAttr.update_custom_attrs(asset, {'编号': '002', '自定义': '是'})
+        self.assertEqual(AssetCustomAttr.objects.count(), 2)
+        self.assertDictEqual(AssetCustomAttr.get_custom_attrs_bulk([asset]),
+                             {asset.id: {'自定义': '是', '编号': '002'}})
+
+    def test_asset_list_page(self):
+        ''' 测试资产列表的游标分页、排序和状态过滤 '''
+        old = Asset.objects.get(id=1)
+        for i in range(5):
+            Asset.objects.create(name=f'资产{i}', value=i, owner=old.owner,
+                                 category=old.category, status='IN_USE' if i % 2 else 'IDLE')
+        path = '/api/asset/list'
+        nids, cursor = [], ''
+        while True:
+            response = self.client.get(path, {'size': 2, 'sort': '-value', 'cursor': cursor}).json()
+            self.assertEqual(response['code'], 200)
+            self.assertLessEqual(len(response['data']), 2)
+            nids += [asset['nid'] for asset in response['data']]
+            cursor = response['next_cursor']
+            if not cursor:
+                break
+        self.assertListEqual(nids, [1, 6, 5, 4, 3, 2])
+
+        response = self.client.get(path, {'status': 'IN_USE'}).json()
+        self.assertListEqual([asset['nid'] for asset in response['data']], [3, 5])
+
+        response = self.client.post('/api/asset/query',
+                                    json.dumps({'name': '资产', 'size': 1, 'sort': ['-nid']}),
+                                    content_type='json').json()
+        self.assertListEqual([asset['nid'] for asset in response['data']], [6])
+        self.assertNotEqual(response['next_cursor'], '')
+
+        response = self.client.get(path, {'sort': '-value'}).json()  # 不给出 cursor 和 size 时不分页
+        self.assertListEqual([asset['nid'] for asset in response['data']], [1, 6, 5, 4, 3, 2])
+        self.assertEqual(response['next_cursor'], '')
+
+        response = self.client.get(path, {'size': 2}).json()
+        response = self.client.get(path, {'cursor': response['next_cursor']}).json()
+        self.assertListEqual([asset['nid'] for asset in response['data']], [3, 4, 5, 6])
+        response = self.client.post('/api/asset/query',
+                                    json.dumps({'cursor': encode_cursor([2])}),
+                                    content_type='json').json()
+        self.assertListEqual([asset['nid'] for asset in response['data']], [3, 4, 5, 6])
+        response = self.client.get(path, {'sort': 'start_time', 'size': 1}).json()
+        response = self.client.get(path, {'sort': 'start_time',
+                                          'cursor': response['next_cursor']}).json()
+        self.assertEqual(len(response['data']), 5)
+
+        cursors = ['!', encode_cursor([]), encode_cursor({'id': 1}), encode_cursor([1, 2]),
+                   encode_cursor(['abc']), encode_cursor([{'a': 1}]), encode_cursor([None])]
+        for cursor in cursors:
+            response = self.client.get(path, {'cursor': cursor}).json()
+            self.assertEqual(response['code'], 201)
+        response = self.client.get(path, {'sort': 'start_time', 'cursor': encode_cursor([[1], 1])})
+        self.assertEqual(response.json()['code'], 201)
+        for paras in ({'size': [1]}, {'sort': [1]}):
+            response = self.client.post('/api/asset/query', json.dumps(paras),
+                                        content_type='json').json()
+            self.assertEqual(response['code'], 201)
+        response = self.client.get(path, {'sort': 'owner'}).json()
+        self.assertEqual(response['code'], 201)
+
+    def test_asset_export(self):
+        ''' 测试资产流式导出 '''
+        path = '/api/asset/export'
+        old = Asset.objects.get(id=1)
+        for i in range(3):
+            Asset.objects.create(name=f'资产{i}', owner=old.owner, category=old.category)
+        response = self.client.get(path)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertListEqual([json.loads(line)['nid'] for line in lines], [1, 2, 3, 4])
+
+        response = self.client.get(path, {'format': 'json', 'status': 'IDLE'})
+        data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        self.assertEqual(len(data), 4)
+        self.assertEqual(data[0], get_assets_list(Asset.objects.filter(id=1))[0])
+
+        response = self.client.get(path, {'format': 'csv'})
+        rows = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(rows[0].endswith(',自定义'))
+
+        response = self.client.get(path, {'format': 'xml'})
+        self.assertEqual(response.json()['code'], 201)
+
+    def test_asset_snapshot(self):
+        ''' 测试按时间点还原资产状态，包括增量存储和已归档的记录 '''
+        asset = Asset.objects.get(id=1)
+        Asset.history.update(history_date=datetime(2020, 1, 1))
+        asset.status = 'IN_USE'
+        asset.save()
+        Asset.history.filter(history_date__gt=datetime(2020, 1, 1)).update(
+            history_date=datetime(2021, 1, 1))
+        asset.status = 'RETIRED'
+        asset.save()
+
+        def snapshot(moment, **params):
+            response = self.client.get('/api/asset/snapshot', {'time': moment, **params})
+            lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+            return {row['nid']: row['status'] for row in map(json.loads, lines)}
+
+        expected = {'2019-12-31': {}, '2020-06-01': {1: 'IDLE'},
+                    '2021-06-01 12:00:00': {1: 'IN_USE'}, '2099-01-01': {1: 'RETIRED'}}
+        for moment, statuses in expected.items():
+            self.assertDictEqual(snapshot(moment), statuses)
+        department = asset.department.name
+        self.assertDictEqual(snapshot('2020-06-01', department=department), {1: 'IDLE'})
+        self.assertDictEqual(snapshot('2020-06-01', department='不存在'), {})
+
+        call_command('compact_history', stdout=io.StringIO())
+        with self.settings(ASSET_HISTORY_BACKEND='delta', HISTORY_SNAPSHOT_INTERVAL=2):
+            for moment, statuses in expected.items():
+                self.assertDictEqual(snapshot(moment), statuses)
+        archive_history(datetime(2022, 1, 1))
+        self.assertTrue(ArchivedAssetHistory.objects.exists())
+        for moment, statuses in expected.items():
+            self.assertDictEqual(snapshot(moment), statuses)
+
+        # 归档后删除的资产：在线的删除记录挡住更早的归档记录
+        Asset.objects.get(id=1).delete()
+        self.assertDictEqual(snapshot('2099-01-01'), {})
+        self.assertDictEqual(snapshot('2021-06-01'), {1: 'IN_USE'})
+        with self.settings(ASSET_HISTORY_BACKEND='delta', HISTORY_SNAPSHOT_INTERVAL=2):
+            self.assertDictEqual(snapshot('2021-06-01 12:00:00'), {1: 'IN_USE'})
+
+        response = self.client.get('/api/asset/snapshot', {'time': 'yesterday'})
+        self.assertEqual(response.json()['code'], 201)
+
+    def test_asset_valuation(self):
+        ''' 测试资产估值与 now_value 一致 '''
+        old = Asset.objects.get(id=1)
+        Asset.objects.create(name='清退资产', value=100, owner=old.owner,
+                             category=old.category, status='RETIRED')
+        response = self.client.get('/api/asset/valuation').json()
+        self.assertEqual(response['code'], 200)
+        total = response['data']['total']
+        self.assertEqual(total['count'], 2)
+        self.assertEqual(total['value'], 10100)
+        self.assertAlmostEqual(total['now_value'],
+                               sum(asset.now_value for asset in Asset.objects.all()))
+        self.assertEqual(response['data']['departments'][0]['department'], old.department.name)
+
+    def test_asset_search(self):
+        ''' 测试全文检索与 LIKE 查询结果一致，并随写入增量更新 '''
+        old = Asset.objects.get(id=1)
+        self.assertTrue(fts_enabled())
+        asset = Asset.objects.create(name='Laptop Pro', description='服务器机柜', owner=old.owner,
+                                     category=old.category)
+        AssetCustomAttr.update_custom_attrs(asset, {'自定义': 'SN-12345'})
+        for field, keyword in [('name', 'laptop'), ('name', '旧资产'), ('description', '服务器'),
+                               ('description', '服务'), ('name', '"x')]:
+            self.assertSetEqual(set(search_assets(Asset.objects.all(), field, keyword)),
+                                set(Asset.objects.filter(**{f'{field}__icontains': keyword})))
+
+        asset.name = '台式机'
+        asset.save()
+        self.assertFalse(search_assets(Asset.objects.all(), 'name', 'Laptop').exists())
+        assets = AssetCustomAttr.search_custom_attr('自定义', '123', Asset.objects.all())
+        self.assertListEqual(list(assets), [asset])
+        AssetCustomAttr.update_custom_attrs(asset, {})
+        assets = AssetCustomAttr.search_custom_attr('自定义', '123', Asset.objects.all())
+        self.assertFalse(assets.exists())
+
+        # 触发器缺失时索引已过期，退回 LIKE 查询
+        self.assertListEqual(search.missing_fts_triggers(), [])
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER asset_asset_fts_au')
+        search._FTS_ENABLED.clear()
+        self.addCleanup(search._FTS_ENABLED.clear)
+        self.assertListEqual(search.missing_fts_triggers(), ['asset_asset_fts_au'])
+        self.assertFalse(fts_enabled())
+        asset.name = 'Laptop Air'
+        asset.save()
+        self.assertListEqual(list(search_assets(Asset.objects.all(), 'name', 'Laptop')), [asset])
+
+    def test_entire_tree(self):
+        ''' 测试一次查询取出整棵资产树，顺序与层次遍历一致 '''
+        root = Asset.objects.get(id=1)
+        level = [root]
+        for _ in range(3):
+            level = [Asset.objects.create(name='子资产', parent=parent, owner=root.owner,
+                                          category=root.category)
+                     for parent in level for _ in range(2)]
+        root.refresh_from_db()
+        family = Asset.objects.filter(tree_id=root.tree_id)
+        expected = sorted(family, key=lambda asset: (asset.level, asset.lft))
+        with self.assertNumQueries(1):
+            tree = level[0].get_entire_tree()
+        self.assertListEqual(tree, expected)
+        self.assertEqual(len(tree), 15)
+
+        other = Asset.objects.create(name='其他', owner=root.owner, category=root.category)
+        with self.assertNumQueries(1):
+            trees = Asset.get_entire_trees([root, level[-1], other])
+        self.assertListEqual(trees[root.tree_id], expected)
+        self.assertListEqual(trees[other.tree_id], [other])
+
+    def test_update_trees(self):
+        ''' 测试集合式更新整棵资产树，并批量写入历史记录 '''
+        root = Asset.objects.get(id=1)
+        for _ in range(30):
+            Asset.objects.create(name='子资产', parent=root, owner=root.owner,
+                                 category=root.category)
+        root.refresh_from_db()
+        root.status = 'IN_MAINTAIN'
+        root._change_reason = '维保'
+        with CaptureQueriesContext(connection) as context:
+            root.save(tree_update=True)
+        self.assertLessEqual(len(context), 6)
+        family = Asset.objects.filter(tree_id=root.tree_id)
+        self.assertEqual(family.filter(status='IN_MAINTAIN').count(), 31)
+        records = Asset.history.filter(history_change_reason='维保')
+        self.assertEqual(records.count(), 31)
+        self.assertTrue(all(record.history_type == '~' for record in records))
+
+        response = self.client.post('/api/asset/history', json.dumps({'nid': 1}),
+                                    content_type='json').json()
+        self.assertEqual(response['data'][0]['type'], '维保')
+        self.assertListEqual(response['data'][0]['info'], ['状态 从 空闲中 变为 维护中'])
+
+    def test_asset_import(self):
+        ''' 测试批量导入资产，出错的行单独报告 '''
+        path = '/api/asset/import'
+        old = Asset.objects.get(id=1)
+        Asset.objects.create(name='已有子资产', parent=old, owner=old.owner, category=old.category)
+        rows = [
+            {'name': '显示器', 'value': 100, 'category': self.category, 'parent_id': 1,
+             'custom': {'自定义': '甲'}},
+            {'name': '键盘', 'value': 10, 'category': self.category, 'parent_id': 1},
+            {'name': '鼠标', 'value': 'x', 'category': self.category},
+            {'name': '音箱', 'value': 1, 'category': '无此类别'},
+            {'name': '主机', 'value': 1000, 'category': self.category},
+            '耳机',
+            [{'name': '音响'}],
+            {'name': '话筒', 'value': 1, 'category': self.category, 'custom': ['x']},
+        ]
+        response = self.client.post(path, json.dumps({'data': rows}),
+                                    content_type='json').json()
+        self.assertEqual(response['code'], 200)
+        self.assertEqual(response['data']['created'], 3)
+        self.assertListEqual(sorted(error['row'] for error in response['data']['errors']),
+                             [3, 4, 6, 7, 8])
+
+        old.refresh_from_db()
+        self.assertListEqual([str(child) for child in old.get_children()],
+                             ['已有子资产(id=2)', '显示器(id=3)', '键盘(id=4)'])
+        self.assertEqual(old.get_descendant_count(), 3)
+        self.assertTrue(Asset.objects.get(name='主机').is_root_node())
+        self.assertEqual(AssetCustomAttr.get_custom_attrs(Asset.objects.get(name='显示器')),
+                         {'自定义': '甲'})
+        self.assertEqual(Asset.history.filter(history_type='+').count(), 5)
+
+        upload = SimpleUploadedFile('assets.csv', (f'name,value,category,parent_id,自定义\n'
+                                                   f'打印机,50,{self.category},4,乙\n').encode())
+        response = self.client.post(path, {'file': upload}).json()
+        self.assertEqual(response['data']['created'], 1)
+        printer = Asset.objects.get(name='打印机')
+        self.assertEqual(printer.parent_id, 4)
+        self.assertEqual(printer.get_root(), old)
+        self.assertEqual(AssetCustomAttr.get_custom_attrs(printer), {'自定义': '乙'})
+
+        # 与 mptt 自身重建的结果一致
+        def family():
+            return list(Asset.objects.filter(tree_id=Asset.objects.get(id=1).tree_id)
+                        .values_list('id', 'parent_id', 'lft', 'rght', 'level'))
+        before = family()
+        Asset.objects.rebuild()
+        self.assertListEqual(family(), before)
+
+    def test_history_page(self):
+        ''' 测试资产历史与逐条 diff_against 的结果一致 '''
+        asset = Asset.objects.get(id=1)
+        for i in range(5):
+            asset.description = f'描述{i}'
+            asset.status = 'IN_USE' if i % 2 else 'IDLE'
+            asset.owner = User.admin()
+            asset._change_reason = '修改' if i == 3 else None
+            asset.save()
+
+        expected = []
+        for record in asset.history.all():
+            user = record.history_user
+            item = {'user': 'unknown' if user is None else user.username,
+                    'time': record.history_date.strftime('%Y-%m-%d %H:%M:%S'),
+                    'type': record.history_change_reason or HISTORY_OP_TYPE[record.history_type],
+                    'info': []}
+            if record.prev_record is not None:
+                for change in record.diff_against(record.prev_record).changes:
+                    field = {'owner': 'owner_id', 'parent': 'parent_id'}.get(change.field,
+                                                                            change.field)
+                    item['info'].append(f"{FIELD_TO_ZH[field]} 从 "
+                                        f"{CODE_TO_ZH[change.old]} 变为 {CODE_TO_ZH[change.new]}")
+            expected.append(item)
+        with self.assertNumQueries(1):
+            self.assertListEqual(get_history_page(asset.id), expected)
+        self.assertListEqual(get_history_page(asset.id, 2, 3), expected[2:5])
+
+        response = self.client.post('/api/asset/history', json.dumps({'nid': 1, 'size': 2}),
+                                    content_type='json').json()
+        self.assertListEqual(response['data'], expected[:2])
+        self.assertEqual(response['total'], len(expected))
+
+        for paras in ({'offset': 'x'}, {'size': 'x'}, {'size': [1]}):
+            response = self.client.post('/api/asset/history', json.dumps({'nid': 1, **paras}),
+                                        content_type='json').json()
+            self.assertEqual(response['code'], 201)
+        response = self.client.post('/api/asset/history',
+                                    json.dumps({'nid': 1, 'offset': -1, 'size': 10 ** 9}),
+                                    content_type='json').json()
+        self.assertListEqual(response['data'], expected)
+
+    @override_settings(ASSET_HISTORY_BACKEND='delta', HISTORY_SNAPSHOT_INTERVAL=3)
+    def test_delta_history(self):
+        ''' 测试增量存储的历史记录，还原结果与完整记录一致 '''
+        asset = Asset.objects.get(id=1)
+        Asset.history.all().delete()
+        for i in range(5):
+            asset.description = f'描述{i}'
+            asset.status = 'IN_USE' if i % 2 else 'IDLE'
+            asset.save()
+        asset.status = 'IN_MAINTAIN'
+        asset._change_reason = '维保'
+        asset.save(tree_update=True)
+        self.assertEqual(Asset.history.count(), 0)
+        deltas = AssetHistoryDelta.objects.filter(asset_id=asset.id).order_by('id')
+        self.assertListEqual([delta.depth for delta in deltas], [0, 1, 2, 0, 1, 2])
+        self.assertDictEqual(json.loads(deltas[4].changes),
+                             {'description': '描述4', 'status': 'IDLE'})
+
+        expected = get_history_page(asset.id)
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(expected[0]['type'], '维保')
+        self.assertListEqual(expected[0]['info'], ['状态 从 空闲中 变为 维护中'])
+        self.assertListEqual(expected[1]['info'], ['描述 从 描述3 变为 描述4',
+                                                   '状态 从 使用中 变为 空闲中'])
+        self.assertListEqual(expected[-1]['info'], [])
+        for offset in range(len(expected)):
+            self.assertListEqual(get_history_page(asset.id, offset, 2), expected[offset:offset + 2])
+        response = self.client.post('/api/asset/history', json.dumps({'nid': 1}),
+                                    content_type='json').json()
+        self.assertEqual(response['total'], 6)
+
+        # 过期的实例和并发的保存：增量与已存储的最后状态比较
+        stale = Asset.objects.get(id=asset.id)
+        asset.description = '新描述'
+        asset.save()
+        stale.status = 'IDLE'
+        stale.save()
+        last = AssetHistoryDelta.objects.filter(asset_id=asset.id).latest('id')
+        self.assertDictEqual(json.loads(last.changes), {'description': '描述4', 'status': 'IDLE'})
+        self.assertEqual(AssetHistoryDelta.get_records(asset.id, 0, 1)[0]['description'], '描述4')
+
+    def test_compact_history(self):
+        ''' 测试将完整记录转换为增量记录 '''
+        asset = Asset.objects.get(id=1)
+        for i in range(5):
+            asset.description = f'描述{i}'
+            asset.status = 'IN_USE' if i % 2 else 'IDLE'
+            asset.save()
+        expected = get_history_page(asset.id)
+        call_command('compact_history', delete=True, stdout=io.StringIO())
+        self.assertEqual(Asset.history.count(), 0)
+        with self.settings(ASSET_HISTORY_BACKEND='delta'):
+            self.assertListEqual(get_history_page(asset.id), expected)
+
+    def test_archive_history(self):
+        ''' 测试归档历史记录后仍能透明地读取完整的历史 '''
+        asset = Asset.objects.get(id=1)
+        for i in range(5):
+            asset.description = f'描述{i}'
+            asset.status = 'IN_USE' if i % 2 else 'IDLE'
+            asset.save()
+        records = list(asset.history.order_by('history_id'))
+        for days, record in zip(range(len(records), 0, -1), records):
+            record.history_date -= timedelta(days=days * 100)
+            record.save()
+        expected = get_history_page(asset.id)
+
+        call_command('archive_history', days=250, chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(ArchivedAssetHistory.objects.count(), len(records) - 3)
+        # 两条晚于截止时间的记录和一条检查点留在历史表中
+        self.assertEqual(asset.history.count(), 3)
+        self.assertListEqual(get_history_page(asset.id), expected)
+        for offset in range(len(expected)):
+            self.assertListEqual(get_history_page(asset.id, offset, 2), expected[offset:offset + 2])
+        response = self.client.post('/api/asset/history', json.dumps({'nid': 1}),
+                                    content_type='json').json()
+        self.assertEqual(response['total'], len(expected))
@@ -5,7 +5,11 @@ from . import views
 
 urlpatterns = [
     path('list', views.asset_list),
+    path('export', views.asset_export),
+    path('valuation', views.asset_valuation),
+    path('snapshot', views.asset_snapshot),
     path('add', views.asset_add),
+    path('import', views.asset_import),
     path('edit', views.asset_edit),
     path('history', views.asset_history),
     path('query', views.asset_query),
@@ -1,13 +1,57 @@
 ''' utils function for App asset '''
-from app.utils import EchoDict
+import csv
+import heapq
+import json
+import operator
+from collections import defaultdict
+from datetime import datetime
+from functools import reduce
+from itertools import groupby, islice
+from operator import itemgetter
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import (Case, Count, ExpressionWrapper, F, FloatField, Max,
+                              OuterRef, Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Cast, ExtractYear, Greatest
+
+from app.utils import MAX_PAGE_SIZE, PAGE_SIZE, EchoDict, decode_cursor, encode_cursor
+from user.models import User
+from .models import (ArchivedAssetHistory, Asset, AssetCustomAttr, AssetHistoryDelta,
+                     CustomAttr, delta_history_enabled)
 
 HISTORY_OP_TYPE = {'~': '更新', '+': '创建', '-': '删除'}
+# 历史记录中会变化的字段，键为字段的 attname，按模型中的字段顺序排列
 FIELD_TO_ZH = {
     'name': '资产名',
     'description': '描述',
-    'parent': '父资产id',
+    'parent_id': '父资产id',
     'status': '状态',
-    'owner': '挂账人',
+    'owner_id': '挂账人',
+}
+HISTORY_VALUES = ['history_date', 'history_type', 'history_change_reason',
+                  'history_user_id', *FIELD_TO_ZH]
+# 资产列表可排序的字段，键为 to_dict 中的字段名
+SORT_FIELDS = {
+    'nid': 'id',
+    'name': 'name',
+    'value': 'value',
+    'status': 'status',
+    'start_time': 'start_time',
+    'service_life': 'service_life',
+}
+PAGE_ARGS = ('cursor', 'size', 'sort', 'status')
+EXPORT_CHUNK_SIZE = 500
+ARCHIVE_CHUNK_SIZE = 1000
+# 增量存储还原时每次查询的资产数，OR 条件过多会超出 SQLite 的表达式深度限制
+SNAPSHOT_CHUNK_SIZE = 100
+EXPORT_FIELDS = ['nid', 'name', 'value', 'now_value', 'category', 'description',
+                 'parent_id', 'parent', 'children_', 'status', 'owner', 'department',
+                 'start_time', 'service_life']
+EXPORT_CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'json': 'application/json; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
 }
 CODE_TO_ZH = EchoDict({
     'IDLE': '空闲中',
@@ -17,28 +61,336 @@ CODE_TO_ZH = EchoDict({
 })
 
 
-def gen_history(record):
-    ''' 根据历史记录获得历史 '''
+def gen_history(record: dict, prev_record: dict = None) -> dict:
+    ''' 根据历史记录及其前一条记录获得历史，记录为 HISTORY_VALUES 字段的字典 '''
+    user = record['history_user_id']  # 用户的主键即用户名
     record_dict = {
-        'user': 'unknown' if record.history_user is None else record.history_user.username,
-        'time': record.history_date.strftime('%Y-%m-%d %H:%M:%S'),
-        'type': HISTORY_OP_TYPE[record.history_type],
+        'user': 'unknown' if user is None else user,
+        'time': record['history_date'].strftime('%Y-%m-%d %H:%M:%S'),
+        'type': HISTORY_OP_TYPE[record['history_type']],
     }
 
-    if record.history_change_reason is not None:
-        record_dict['type'] = record.history_change_reason
+    if record['history_change_reason'] is not None:
+        record_dict['type'] = record['history_change_reason']
     info = []
-    if record.prev_record is not None:
-        delta = record.diff_against(record.prev_record)
-        for change in delta.changes:
-            info.append(f"{FIELD_TO_ZH[change.field]} 从 "
-                        f"{CODE_TO_ZH[change.old]} 变为 {CODE_TO_ZH[change.new]}")
+    if prev_record is not None:
+        for field, field_zh in FIELD_TO_ZH.items():
+            old, new = prev_record[field], record[field]
+            if old != new:
+                info.append(f"{field_zh} 从 {CODE_TO_ZH[old]} 变为 {CODE_TO_ZH[new]}")
     record_dict['info'] = info
     return record_dict
 
 
+def get_history_page(asset_id: int, offset=0, size=PAGE_SIZE) -> list:
+    '''
+    按时间倒序分页获得资产的历史，size 不超过 MAX_PAGE_SIZE
+    一次查询取出本页及其后的一条记录，在内存中依次与前一条记录比较
+    在线记录不足一页时才读取归档的记录，归档记录都早于在线记录，见 archive_history
+    '''
+    try:
+        offset = max(int(offset), 0)
+        size = min(max(int(size), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise KeyError('http 参数 offset 或 size 不合法')
+    if delta_history_enabled():
+        records = AssetHistoryDelta.get_records(asset_id, offset, size + 1)
+        return [gen_history(record, records[i + 1] if i + 1 < len(records) else None)
+                for i, record in enumerate(records[:size])]
+    records = list(Asset.history.filter(id=asset_id)
+                   .order_by('-history_date', '-history_id')
+                   .values(*HISTORY_VALUES)[offset:offset + size + 1])
+    # 已取到创建记录时，更早的记录不存在，无需读取归档
+    if len(records) < size + 1 and (not records or records[-1]['history_type'] != '+'):
+        live_count = offset + len(records) if records else \
+            Asset.history.filter(id=asset_id).count()
+        start = max(offset - live_count, 0)
+        records += (ArchivedAssetHistory.objects.filter(asset_id=asset_id)
+                    .order_by('-history_date', '-history_id')
+                    .values(*HISTORY_VALUES)[start:start + size + 1 - len(records)])
+    return [gen_history(record, records[i + 1] if i + 1 < len(records) else None)
+            for i, record in enumerate(records[:size])]
+
+
+def count_history(asset_id: int) -> int:
+    ''' 资产的历史记录总数，包括已归档的记录 '''
+    if delta_history_enabled():
+        return AssetHistoryDelta.objects.filter(asset_id=asset_id).count()
+    return (Asset.history.filter(id=asset_id).count()
+            + ArchivedAssetHistory.objects.filter(asset_id=asset_id).count())
+
+
+def archive_history(cutoff: datetime, chunk_size: int = ARCHIVE_CHUNK_SIZE) -> int:
+    '''
+    将早于 cutoff 的资产历史记录分批移入归档表，每批一个事务
+    每个资产早于 cutoff 的最新一条记录作为检查点留在历史表中，
+    使在线记录中最早的一条仍能与前一条记录比较
+    只处理完整记录，增量存储的记录本身已经足够紧凑
+    return: 归档的记录数
+    '''
+    checkpoints = (Asset.history.filter(history_date__lt=cutoff).values('id')
+                   .annotate(last=Max('history_id')).values('last'))
+    stale = (Asset.history.filter(history_date__lt=cutoff)
+             .exclude(history_id__in=checkpoints).order_by('history_id'))
+    fields = ['history_id', 'id', *HISTORY_VALUES]
+    archived = 0
+    while True:
+        with transaction.atomic():
+            rows = list(stale.values(*fields)[:chunk_size])
+            if not rows:
+                return archived
+            ArchivedAssetHistory.objects.bulk_create(
+                ArchivedAssetHistory(asset_id=row.pop('id'), **row) for row in rows)
+            Asset.history.filter(history_id__in=[row['history_id'] for row in rows]).delete()
+        archived += len(rows)
+
+
+def iter_snapshot(moment: datetime):
+    '''
+    还原 moment 时刻全部资产的名称、状态和挂账人，按资产 id 顺序逐个生成
+    完整记录：一次分组查询取每个资产在 moment 之前的最新一条记录，
+    归档表中的记录只用于在线记录中没有 moment 之前记录的资产
+    yield: (asset_id, name, status, owner_id)，已删除的资产不出现
+    '''
+    if delta_history_enabled():
+        yield from iter_delta_snapshot(moment)
+        return
+    fields = ['name', 'status', 'owner_id']
+    latest = (Asset.history.filter(history_date__lte=moment).values('id')
+              .annotate(last=Max('history_id')).values('last'))
+    live = (Asset.history.filter(history_id__in=latest)
+            .order_by('id').values_list('id', *fields, 'history_type').iterator())
+    latest = (ArchivedAssetHistory.objects.filter(history_date__lte=moment).values('asset_id')
+              .annotate(last=Max('history_id')).values('last'))
+    archived = (ArchivedAssetHistory.objects.filter(history_id__in=latest)
+                .order_by('asset_id').values_list('asset_id', *fields, 'history_type').iterator())
+    prev_id = None
+    # 同一资产的在线记录总是晚于归档记录，merge 对相同的 id 先给出在线记录，
+    # 在线的删除记录同样会挡住更早的归档记录
+    for asset_id, *values, history_type in heapq.merge(live, archived, key=itemgetter(0)):
+        if asset_id != prev_id and history_type != '-':
+            yield (asset_id, *values)
+        prev_id = asset_id
+
+
+def iter_delta_snapshot(moment: datetime):
+    '''
+    iter_snapshot 的增量存储版本
+    一次分组查询取每个资产在 moment 之前的最新一条记录及其之前最近的快照，
+    再按资产分批只取出快照到最新记录之间的记录重放
+    '''
+    latest = (AssetHistoryDelta.objects.filter(history_date__lte=moment).values('asset_id')
+              .annotate(last=Max('id')).values('last'))
+    snapshot = (AssetHistoryDelta.objects
+                .filter(asset_id=OuterRef('asset_id'), depth=0, id__lte=OuterRef('id'))
+                .order_by('-id').values('id')[:1])
+    heads = (AssetHistoryDelta.objects.filter(id__in=latest).exclude(history_type='-')
+             .annotate(snapshot=Subquery(snapshot)).order_by('asset_id')
+             .values_list('asset_id', 'snapshot', 'id').iterator())
+    while True:
+        chunk = list(islice(heads, SNAPSHOT_CHUNK_SIZE))
+        if not chunk:
+            return
+        windows = reduce(operator.or_, (Q(asset_id=asset_id, id__gte=first, id__lte=last)
+                                        for asset_id, first, last in chunk))
+        rows = (AssetHistoryDelta.objects.filter(windows).order_by('asset_id', 'id')
+                .values_list('asset_id', 'changes'))
+        for asset_id, records in groupby(rows, key=itemgetter(0)):
+            state = {}
+            for _, changes in records:
+                state.update(json.loads(changes))
+            yield asset_id, state['name'], state['status'], state['owner_id']
+
+
+def export_snapshot(moment: datetime, department=None):
+    '''
+    以生成器的形式导出 moment 时刻的资产，每行一个 JSON 对象
+    部门为挂账人当前所在的部门，department 不为空时只导出该部门的资产
+    '''
+    departments = dict(User.objects.values_list('username', 'department__name'))
+    for asset_id, name, status, owner in iter_snapshot(moment):
+        if department is not None and departments.get(owner) != department:
+            continue
+        yield json.dumps({'nid': asset_id, 'name': name, 'status': status, 'owner': owner,
+                          'department': departments.get(owner)}, ensure_ascii=False) + '\n'
+
+
+def serialize_assets(assets: list) -> list:
+    ''' 序列化已取出的资产
+
+    批量加载关联数据，查询次数与资产数量无关：
+    子资产一次，自定义属性两次，
+    挂账人、部门、类别、父资产应在取出资产时 select_related
+    '''
+    children = defaultdict(list)
+    for child in Asset.objects.filter(parent__in=assets).only('id', 'name', 'parent_id'):
+        children[child.parent_id].append(child)
+    customs = AssetCustomAttr.get_custom_attrs_bulk(assets)
+    return [asset.to_dict(children=children[asset.id], custom=customs[asset.id])
+            for asset in assets]
+
+
 def get_assets_list(assets):
     ''' 根据Query Set获得资产列表 '''
-    res = [asset.to_dict() for asset in assets]
-    res.sort(key=lambda asset: asset['nid'])
-    return res
+    assets = assets.select_related('owner__department', 'category', 'parent')
+    return serialize_assets(list(assets.order_by('id')))
+
+
+def split_arg(arg) -> list:
+    ''' 参数可以是列表，也可以是逗号分隔的字符串 '''
+    if isinstance(arg, str):
+        return [item for item in arg.split(',') if item]
+    return list(arg)
+
+
+def get_page_args(query) -> dict:
+    ''' 从 GET 参数中取出分页参数 '''
+    return {arg: query[arg] for arg in PAGE_ARGS if arg in query}
+
+
+def to_cursor_value(field: str, value):
+    ''' 将游标中的值转换为排序字段的类型，不合法时抛出 KeyError '''
+    try:
+        value = Asset._meta.get_field(field).to_python(value)
+    except (ValidationError, TypeError):
+        value = None
+    if value is None:
+        raise KeyError('http 参数 cursor 不合法')
+    return value
+
+
+def get_assets_page(assets, cursor='', size='', sort='nid', status=''):
+    '''
+    按游标(keyset)分页获得资产列表，过滤、排序和截断都在数据库中完成
+
+    参数:
+        cursor: 上一页返回的 next_cursor，为空时返回第一页
+        size: 页大小，默认 PAGE_SIZE，不超过 MAX_PAGE_SIZE
+            cursor 和 size 都未给出时不分页，返回全部资产，与分页前的接口一致
+        sort: 排序键列表，见 SORT_FIELDS，前缀 '-' 表示降序，总以 nid 兜底
+        status: 状态列表，为空时不过滤
+    return: (资产列表, next_cursor)，没有下一页时 next_cursor 为空串
+    '''
+    try:
+        size = min(max(int(size), 1), MAX_PAGE_SIZE) if size not in (None, '') else None
+        keys = [(SORT_FIELDS[key.lstrip('-')], key.startswith('-'))
+                for key in split_arg(sort)]
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise KeyError('http 参数 size 或 sort 不合法')
+    paged = bool(cursor) or size is not None
+    size = size or PAGE_SIZE
+    if 'id' not in (field for field, _ in keys):
+        keys.append(('id', False))
+
+    statuses = split_arg(status)
+    if statuses:
+        assets = assets.filter(status__in=statuses)
+    if cursor:
+        values = [to_cursor_value(field, value)
+                  for (field, _), value in zip(keys, decode_cursor(cursor, len(keys)))]
+        # (k1 > v1) or (k1 = v1 and k2 > v2) or ...
+        conditions = []
+        for i, (field, desc) in enumerate(keys):
+            equals = {prev: value for (prev, _), value in zip(keys[:i], values)}
+            lookup = f"{field}__{'lt' if desc else 'gt'}"
+            conditions.append(Q(**equals, **{lookup: values[i]}))
+        assets = assets.filter(reduce(lambda lhs, rhs: lhs | rhs, conditions))
+
+    order = [f"{'-' if desc else ''}{field}" for field, desc in keys]
+    assets = assets.select_related('owner__department', 'category', 'parent').order_by(*order)
+    if not paged:
+        return serialize_assets(list(assets)), ''
+    page = list(assets[:size + 1])
+    next_cursor = ''
+    if len(page) > size:
+        page = page[:size]
+        next_cursor = encode_cursor([getattr(page[-1], field) for field, _ in keys])
+    return serialize_assets(page), next_cursor
+
+
+def iter_assets_chunks(assets, chunk_size=EXPORT_CHUNK_SIZE):
+    ''' 按 id 分块遍历并批量序列化资产，每次只在内存中保留一块 '''
+    cursor = ''
+    while True:
+        res, cursor = get_assets_page(assets, cursor, chunk_size)
+        yield res
+        if not cursor:
+            return
+
+
+class EchoBuffer:
+    ''' 供 csv.writer 使用的伪文件，write 直接返回写入的内容 '''
+
+    def write(self, value):
+        ''' 返回而非缓存 '''
+        return value
+
+
+def export_assets(assets, fmt: str):
+    '''
+    以生成器的形式导出资产，供 StreamingHttpResponse 使用
+    fmt: jsonl 每行一个资产，json 资产数组，csv 自定义属性各占一列
+    '''
+    chunks = iter_assets_chunks(assets)
+    if fmt == 'jsonl':
+        for chunk in chunks:
+            yield ''.join(json.dumps(asset, ensure_ascii=False) + '\n' for asset in chunk)
+    elif fmt == 'json':
+        yield '['
+        first = True
+        for chunk in chunks:
+            for asset in chunk:
+                yield ('' if first else ',') + json.dumps(asset, ensure_ascii=False)
+                first = False
+        yield ']'
+    elif fmt == 'csv':
+        keys = list(CustomAttr.get_keys())
+        writer = csv.writer(EchoBuffer())
+        yield '\ufeff' + writer.writerow(EXPORT_FIELDS + keys)  # BOM 便于 Excel 识别编码
+        for chunk in chunks:
+            yield ''.join(writer.writerow([asset[field] for field in EXPORT_FIELDS] +
+                                          [asset['custom'].get(key, '') for key in keys])
+                          for asset in chunk)
+
+
+def now_value_expression(now: datetime = None):
+    ''' 与 Asset.now_value 相同的直线折旧，写成 SQL 表达式，以便在数据库中整体计算 '''
+    now = datetime.now() if now is None else now
+    remaining = Greatest(F('service_life') - (Value(now.year) - ExtractYear('start_time')),
+                         Value(0))
+    rate = ExpressionWrapper(Cast(remaining, FloatField()) / F('service_life'),
+                             output_field=FloatField())
+    return Case(When(status='RETIRED', then=Value(0.0)),
+                default=ExpressionWrapper(F('value') * rate, output_field=FloatField()),
+                output_field=FloatField())
+
+
+def get_valuation(assets) -> dict:
+    '''
+    一次分组查询得到资产估值，按部门和类别汇总
+    return: {total, departments, categories, data}，
+        每项为 {count, value, now_value}，data 为部门-类别交叉分组
+    '''
+    rows = (assets.order_by()
+            .values_list('owner__department__name', 'category__name')
+            .annotate(asset_count=Count('id'), value_sum=Sum('value'),
+                      now_value_sum=Sum(now_value_expression())))
+    data = [{'department': department, 'category': category,
+             'count': count, 'value': value, 'now_value': now_value}
+            for department, category, count, value, now_value in rows]
+
+    def add(group: dict, row: dict):
+        for field in ('count', 'value', 'now_value'):
+            group[field] = group.get(field, 0) + row[field]
+
+    total, departments, categories = {}, defaultdict(dict), defaultdict(dict)
+    for row in data:
+        add(total, row)
+        add(departments[row['department']], row)
+        add(categories[row['category']], row)
+    return {
+        'total': total or {'count': 0, 'value': 0, 'now_value': 0},
+        'departments': [{'department': name, **group} for name, group in departments.items()],
+        'categories': [{'category': name, **group} for name, group in categories.items()],
+        'data': data,
+    }
@@ -1,25 +1,88 @@
 '''views for app asset'''
+import json
+from datetime import datetime
+
 from django.db.utils import IntegrityError
+from django.http import StreamingHttpResponse
 from mptt.exceptions import InvalidMove
 
-from app.utils import (catch_exception, gen_response, parse_args, parse_list,
-                       visit_tree)
+from app.utils import LOGGER, PAGE_SIZE, catch_exception, gen_response, parse_args, parse_list
 from department.models import Department
 from user.utils import auth_permission_required
 
+from .importer import import_assets, iter_csv_rows
 from .models import Asset, AssetCategory, CustomAttr, AssetCustomAttr
-from .utils import gen_history, get_assets_list
+from .search import search_assets
+from .utils import (EXPORT_CONTENT_TYPES, count_history, export_assets, export_snapshot,
+                    get_assets_page, get_history_page, get_page_args, get_valuation,
+                    split_arg)
 
 
 @catch_exception('GET')
 @auth_permission_required()
 def asset_list(request):
     '''api/asset/list GET
-    return an asset list for asset manager'''
+    return an asset list for asset manager
+    para: cursor(str), size(int), sort(str), status(str) 见 get_assets_page
+        cursor 和 size 都未给出时返回全部资产，否则每页默认 100 条
+    return: data([{}]), next_cursor(str)
+    '''
     department = request.user.department
     all_assets = Asset.objects.filter(owner__department=department)
-    res = get_assets_list(all_assets)
-    return gen_response(code=200, data=res)
+    res, next_cursor = get_assets_page(all_assets, **get_page_args(request.GET))
+    return gen_response(code=200, data=res, next_cursor=next_cursor)
+
+
+@catch_exception('GET')
+@auth_permission_required()
+def asset_export(request):
+    '''api/asset/export GET
+    流式导出本部门全部资产，内存占用与资产数量无关
+    para: format(str) = jsonl/json/csv, status(str) 状态过滤
+    '''
+    fmt = request.GET.get('format', 'jsonl')
+    if fmt not in EXPORT_CONTENT_TYPES:
+        return gen_response(code=201, message=f'不支持的导出格式 {fmt}')
+    department = request.user.department
+    assets = Asset.objects.filter(owner__department=department)
+    statuses = split_arg(request.GET.get('status', ''))
+    if statuses:
+        assets = assets.filter(status__in=statuses)
+    response = StreamingHttpResponse(export_assets(assets, fmt),
+                                     content_type=EXPORT_CONTENT_TYPES[fmt])
+    response['Content-Disposition'] = f'attachment; filename="assets.{fmt}"'
+    LOGGER.info(f'导出 {department.name} 资产')
+    return response
+
+
+@catch_exception('GET')
+@auth_permission_required()
+def asset_snapshot(request):
+    '''api/asset/snapshot GET
+    流式导出某一时刻全部资产的状态，每行一个 JSON 对象
+    para: time(str) 形如 2020-01-01 12:00:00, department(str) 部门名，只导出该部门的资产
+    return: 每行为 {nid(int), name(str), status(str), owner(str), department(str)}
+    '''
+    try:
+        moment = datetime.fromisoformat(request.GET['time'])
+    except ValueError:
+        raise KeyError('http 参数 time 不合法')
+    department = request.GET.get('department')
+    response = StreamingHttpResponse(export_snapshot(moment, department),
+                                     content_type=EXPORT_CONTENT_TYPES['jsonl'])
+    response['Content-Disposition'] = 'attachment; filename="snapshot.jsonl"'
+    LOGGER.info(f'导出 {moment} 时的资产')
+    return response
+
+
+@catch_exception('GET')
+@auth_permission_required()
+def asset_valuation(request):
+    '''api/asset/valuation GET
+    全部资产的原值与折旧后价值，按部门和类别汇总
+    return: data = {total, departments, categories, data} 见 get_valuation
+    '''
+    return gen_response(code=200, data=get_valuation(Asset.objects.all()))
 
 
 @catch_exception('POST')
@@ -44,7 +107,7 @@ def asset_add(request):
 
     for pack in pack_list:
         value, name, category, description, service_life, parent_id, custom = pack
-        category = AssetCategory.objects.get(name=category)
+        category = AssetCategory.get_by_name(category)
 
         try:
             parent: Asset = Asset.objects.get(id=parent_id)
@@ -69,6 +132,28 @@ def asset_add(request):
     return gen_response(code=200, message=f'添加资产 {len(pack_list)} 条')
 
 
+@catch_exception('POST')
+@auth_permission_required()
+def asset_import(request):
+    '''  api/asset/import POST
+    批量导入资产，挂账人为请求者，可以是:
+        上传的 CSV 文件 file，表头见 asset.importer.IMPORT_FIELDS，其余列为自定义属性
+        与 api/asset/add 相同的请求体 data([{}])
+    出错的行不导入，其余照常导入
+    return: data = {created(int) 导入数, errors([{row(int) 行号, message(str)}])}
+    '''
+    if 'file' in request.FILES:
+        rows = iter_csv_rows(request.FILES['file'])
+    else:
+        try:
+            rows = json.loads(request.body)['data']
+        except json.decoder.JSONDecodeError:
+            raise KeyError('http 参数 data 没有给出')
+    created, errors = import_assets(rows, request.user)
+    return gen_response(code=200, data={'created': created, 'errors': errors},
+                        message=f'导入资产 {created} 条')
+
+
 @catch_exception('POST')
 @auth_permission_required()
 def asset_edit(request):
@@ -108,53 +193,57 @@ def asset_edit(request):
 @auth_permission_required()
 def asset_history(request):
     ''' api/asset/history POST
-    para: nid(int)
-    return: code = ...
+    para: nid(int), offset(int) = 0, size(int) = 100
+    return: code = ..., total(int) 历史记录总数
     data = [
         {time(str), user(str), type(str), info(str)}, ...
     ]
     '''
-    nid = parse_args(request.body, 'nid')[0]
+    nid, offset, size = parse_args(request.body, 'nid', 'offset', 'size',
+                                   offset=0, size=PAGE_SIZE)
     asset = Asset.objects.get(id=nid)
-    history = asset.history.all()
-    res = [gen_history(record) for record in history]
-    return gen_response(code=200, data=res)
+    res = get_history_page(asset.id, offset, size)
+    return gen_response(code=200, data=res, total=count_history(asset.id))
 
 
 @catch_exception('GET')
 @auth_permission_required()
 def asset_available_list(request):
     '''api/asset/available GET
-    返回可以领用(IDLE)的资产
+    返回可以领用(IDLE)的资产，分页参数同 api/asset/list
     '''
     department = request.user.department
     all_assets = Asset.objects.filter(owner__department=department, status='IDLE')
-    res = get_assets_list(all_assets)
-    return gen_response(code=200, data=res)
+    res, next_cursor = get_assets_page(all_assets, **get_page_args(request.GET))
+    return gen_response(code=200, data=res, next_cursor=next_cursor)
 
 
 @catch_exception('POST')
 @auth_permission_required()
 def asset_query(request):
     ''' api/asset/query POST
-    para: name(str), category(str), description(str)
+    para: name(str), category(str), description(str),
+        cursor(str), size(int), sort(str/list), status(str/list) 见 get_assets_page
     '''
     args = parse_args(request.body,
                       'name', 'category', 'description',
                       'customKey', 'customValue',
+                      'cursor', 'size', 'sort', 'status',
                       name='', category='', description='',
-                      customKey='', customValue='')
-    name, category, description, key, value = args
+                      customKey='', customValue='',
+                      cursor='', size='', sort='nid', status='')
+    name, category, description, key, value = args[:5]
+    cursor, size, sort, status = args[5:]
     assets = Asset.objects.filter(owner__department=request.user.department)
-    assets = assets.filter(name__contains=name)
-    assets = assets.filter(description__contains=description)
+    assets = search_assets(assets, 'name', name)
+    assets = search_assets(assets, 'description', description)
     if category != '':
-        category = AssetCategory.objects.get(name=category)
+        category = AssetCategory.get_by_name(category)
         assets = assets.filter(category=category)
     if key != '':
         assets = AssetCustomAttr.search_custom_attr(key, value, assets)
-    res = get_assets_list(assets)
-    return gen_response(data=res, code=200)
+    res, next_cursor = get_assets_page(assets, cursor, size, sort, status)
+    return gen_response(data=res, next_cursor=next_cursor, code=200)
 
 
 @catch_exception('POST')
@@ -182,8 +271,7 @@ def asset_retire(request):
 @auth_permission_required()
 def category_tree(request):
     ''' api/asset/category/tree GET'''
-    root = AssetCategory.root()
-    res = visit_tree(root)
+    res = AssetCategory.tree_dict()
     return gen_response(code=200, data=res)
 
 
@@ -248,17 +336,14 @@ def category_edit(request):
 @auth_permission_required()
 def custom_attr_edit(request):
     ''' api/asset/custom/edit POST
-    修改自定义属性
+    修改自定义属性，只增删变化的属性，被删除属性的属性值由 purge_custom_attrs 命令分批删除
     para:
         - custom(list)
     '''
     attrs = parse_args(request.body, 'custom')[0]
-    CustomAttr.objects.all().delete()
-    for attr in attrs:
-        try:
-            CustomAttr.objects.create(name=attr)
-        except IntegrityError:
-            return gen_response(code=203, message='不能设置两个相同自定义属性')
+    if len(set(attrs)) != len(attrs):
+        return gen_response(code=203, message='不能设置两个相同自定义属性')
+    CustomAttr.set_attrs(attrs)
     return gen_response(code=200, message='修改自定义属性')
 
 
@@ -269,8 +354,7 @@ def custom_attr_list(request):
     api/asset/custom/list GET
     获得自定义属性
     '''
-    attrs = CustomAttr.objects.filter()
-    res = [attr.name for attr in attrs]
+    res = list(CustomAttr.get_keys())
     return gen_response(code=200, data=res)
 
 
@@ -278,21 +362,17 @@ def custom_attr_list(request):
 @auth_permission_required()
 def asset_allocate(request):
     ''' /api/asset/allocate POST
-    调拨资产到请求者(资产管理员)的部门中
-    para:  '''
+    调拨资产及其所在的整棵资产树到部门 id 的资产管理员名下，一个事务内完成
+    para: idList(list) 资产id列表, id(int) 部门id
+    return: data = [{root(str) 资产树的根, count(int) 调拨资产数}, ...]
+    '''
     asset_id_list, department_id = parse_args(request.body, 'idList', 'id')
     department: Department = Department.objects.get(id=department_id)
     target_manager = department.get_asset_manager()
     if target_manager is None:
         return gen_response(code=203, message=f'{department.name} 没有资产管理员')
-    assets = set()
-    for nid in asset_id_list:
-        asset: Asset = Asset.objects.get(id=nid)
-        assets.update(asset.get_entire_tree())
-    for asset in assets:
-        asset.owner = target_manager
-        asset._change_reason = '调拨'
-        asset.save()
-    return gen_response(code=200,
+    trees = Asset.update_trees(Asset.get_tree_ids(asset_id_list), '调拨', owner=target_manager)
+    moved = [{'root': str(family[0]), 'count': len(family)} for family in trees.values()]
+    return gen_response(code=200, data=moved,
                         message=f'{request.user.username} 向部门 {department.name} '
-                                f'调拨 {len(asset_id_list)}资产')
+                                f'调拨 {sum(item["count"] for item in moved)} 资产')
@@ -1,3 +1,7 @@
 #!/bin/sh
 python manage.py migrate
-gunicorn 'app.wsgi' -b 0.0.0.0:80 --access-logfile - --log-level info
+# 常驻清理被删除的自定义属性的属性值，定期归档资产历史记录
+python manage.py purge_custom_attrs --loop &
+python manage.py archive_history --loop &
+# gthread: 等待密码哈希进程池的请求只占用一个线程，同一 worker 的其他线程继续处理请求
+gunicorn 'app.wsgi' -b 0.0.0.0:80 --worker-class gthread --threads 4 --access-logfile - --log-level info
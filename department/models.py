@@ -1,7 +1,13 @@
 '''model definition of department based on mptt'''
 from django.db import models
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from mptt.models import MPTTModel, TreeForeignKey
 
+from app.refcache import RefCache, copy_instance, invalidate
+from app.utils import load_tree_dict
+
 
 class Department(MPTTModel):
     ''' department of an employer'''
@@ -11,13 +17,55 @@ class Department(MPTTModel):
     @classmethod
     def root(cls):
         ''' return the root of the tree'''
-        return cls.objects.first().get_root()
-
-    def get_asset_manager(self):
-        ''' 获得本部门的资产管理员 '''
-        from user.models import User, UserPermission
-        user = User.objects.filter(department=self)
-        for user in user:  # 随机找一个资产管理员
-            if user.has_perm(UserPermission.ASSET.value):
-                return user
-        return None
+        return copy_instance(ROOT.get())
+
+    @classmethod
+    def tree_dict(cls) -> dict:
+        ''' 部门树的嵌套字典，结果来自进程内缓存，不应被修改 '''
+        return TREE.get()
+
+    def get_asset_manager(self, inherit: bool = False):
+        ''' 获得本部门的资产管理员，inherit 为真时本部门没有则沿部门树向上查找 '''
+        return Department.asset_manager_of(self.id, inherit)
+
+    @classmethod
+    def asset_manager_of(cls, department_id: int, inherit: bool = False):
+        ''' 同 get_asset_manager，只需部门 id，结果来自进程内缓存 '''
+        own, inherited = ASSET_MANAGERS.get().get(department_id, (None, None))
+        manager = inherited if inherit else own
+        return None if manager is None else copy_instance(manager)
+
+
+def load_asset_managers() -> dict:
+    '''
+    一次权限联表查询得到各部门的资产管理员，再按部门树的顺序继承上级部门的资产管理员
+    return: {department_id: (本部门的资产管理员, 包括上级部门在内最近的资产管理员)}
+    '''
+    from user.models import User, UserPermission
+    app_label, codename = UserPermission.ASSET.value.split('.')
+    has_perm = (Q(is_superuser=True)  # 与 User.has_perm 一致
+                | Q(user_permissions__content_type__app_label=app_label,
+                    user_permissions__codename=codename)
+                | Q(groups__permissions__content_type__app_label=app_label,
+                    groups__permissions__codename=codename))
+    own = {}
+    for user in User.objects.filter(has_perm, is_active=True).distinct().order_by('username'):
+        own.setdefault(user.department_id, user)
+    managers = {}
+    departments = Department.objects.order_by('tree_id', 'lft').values_list('id', 'parent_id')
+    for nid, parent_id in departments:  # 上级部门总在下级部门之前
+        inherited = managers[parent_id][1] if parent_id in managers else None
+        managers[nid] = (own.get(nid), own.get(nid) or inherited)
+    return managers
+
+
+ROOT = RefCache('department', lambda: Department.objects.first().get_root())
+TREE = RefCache('department', lambda: load_tree_dict(Department))
+ASSET_MANAGERS = RefCache('asset_manager', load_asset_managers)
+
+
+@receiver([post_save, post_delete], sender=Department)
+def invalidate_departments(**kwargs):
+    ''' 部门修改后使缓存失效 '''
+    invalidate('department')
+    invalidate('asset_manager')
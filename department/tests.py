@@ -4,6 +4,7 @@ import json
 from django.test import TestCase
 
 from app.utils import init_test
+from user.models import User, UserPermission
 from .models import Department
 
 
@@ -20,6 +21,21 @@ class DepartmentTest(TestCase):
         ''' test for department/tree '''
         response = self.client.get(path='/api/department/tree')
         self.assertEqual(response.json()['code'], 200)
+        tree = response.json()['data']
+        self.assertEqual(tree['name'], '总公司')
+        self.assertListEqual([child['name'] for child in tree['children']],
+                             [child.name for child in Department.root().get_children()])
+        with self.assertNumQueries(0):
+            self.assertDictEqual(Department.tree_dict(), tree)
+
+        self.client.post('/api/department/edit', data=json.dumps({'id': 2, 'name': '新部门'}),
+                         content_type='json')
+        tree = self.client.get(path='/api/department/tree').json()['data']
+        self.assertEqual(tree['children'][0]['name'], '新部门')
+
+        Department.objects.create(name='孙部门', parent=Department.objects.get(id=2))
+        tree = self.client.get(path='/api/department/tree').json()['data']
+        self.assertIn('孙部门', [child['name'] for child in tree['children'][0]['children']])
 
     def test_add_and_delete(self):
         ''' test for department/add '''
@@ -51,3 +67,24 @@ class DepartmentTest(TestCase):
         }
         response = self.client.post(path, data=json.dumps(paras), content_type='json')
         self.assertEqual(response.json()['code'], 200)
+
+    def test_asset_manager(self):
+        ''' 测试各部门资产管理员的解析，包括继承上级部门的资产管理员 '''
+        root = Department.root()
+        child = Department.objects.get(name='子部门')
+        grandchild = Department.objects.create(name='孙部门', parent=child)
+        admin = User.admin()
+        self.assertEqual(root.get_asset_manager(), admin)  # 超级用户拥有全部权限
+        self.assertIsNone(grandchild.get_asset_manager())
+        with self.assertNumQueries(0):
+            self.assertEqual(grandchild.get_asset_manager(inherit=True), admin)
+
+        manager = User.objects.create(username='manager', department=child)
+        manager.set_roles(['ASSET'])
+        self.assertTrue(manager.has_perm(UserPermission.ASSET.value))
+        self.assertEqual(grandchild.get_asset_manager(inherit=True), manager)
+        manager.set_roles([])
+        self.assertEqual(grandchild.get_asset_manager(inherit=True), admin)
+        manager.set_roles(['ASSET'])
+        manager.delete()
+        self.assertEqual(child.get_asset_manager(inherit=True), admin)
@@ -1,5 +1,5 @@
 '''views of app department'''
-from app.utils import catch_exception, gen_response, parse_args, visit_tree
+from app.utils import catch_exception, gen_response, parse_args
 from user.utils import auth_permission_required
 from .models import Department
 
@@ -8,8 +8,7 @@ from .models import Department
 @auth_permission_required()
 def department_tree(request):
     ''' api/department/tree GET '''
-    root = Department.objects.first().get_root()
-    res = visit_tree(root)
+    res = Department.tree_dict()
     return gen_response(code=200, data=res)
 
 
@@ -54,8 +54,15 @@ class Issue(AbstractIssue):
     ]
     type_name = models.CharField(max_length=10, choices=type_choices)
 
-    def to_dict(self):
-        ''' 转换成字典 '''
+    def get_assets(self) -> list:
+        ''' 事项直接关联的资产 '''
+        return [self.asset]
+
+    def to_dict(self, trees: dict = None):
+        ''' 转换成字典
+        trees: 预先取出的资产树，见 Asset.get_entire_trees '''
+        if trees is None:
+            trees = Asset.get_entire_trees(self.get_assets())
         res = super().to_dict()
         res.update({
             'type_name': self.type_name,
@@ -63,7 +70,7 @@ class Issue(AbstractIssue):
             'info': '',
             'asset': ''
         })
-        assets = self.asset.get_entire_tree()
+        assets = trees[self.asset.tree_id]
         res['asset'] = ','.join(str(asset) for asset in assets)
 
         if self.type_name == 'MAINTAIN':
@@ -82,8 +89,16 @@ class RequireIssue(AbstractIssue):
                                        related_name='领用资产类型')
     reason = models.TextField(verbose_name='申请理由')
 
-    def to_dict(self):
-        ''' 转换成字典 '''
+    def get_assets(self) -> list:
+        ''' 事项直接关联的资产 '''
+        return list(self.asset.all())
+
+    def to_dict(self, trees: dict = None):
+        ''' 转换成字典
+        trees: 预先取出的资产树，见 Asset.get_entire_trees '''
+        assets = self.get_assets()
+        if trees is None:
+            trees = Asset.get_entire_trees(assets)
         res = super().to_dict()
         res.update({
             'type_name': 'REQUIRE',
@@ -91,8 +106,6 @@ class RequireIssue(AbstractIssue):
             'info': f'资产类别: {self.asset_category.name} 事由：{self.reason}',
             'asset': ''
         })
-        assets = set()
-        for asset in self.asset.all():
-            assets.update(asset.get_entire_tree())
-        res['asset'] = ','.join(str(asset) for asset in assets)
+        tree_ids = dict.fromkeys(asset.tree_id for asset in assets)
+        res['asset'] = ','.join(str(asset) for tree_id in tree_ids for asset in trees[tree_id])
         return res
@@ -1,7 +1,16 @@
 ''' utils function for App issue '''
+from asset.models import Asset
 
 
 def get_issues_list(issues):
-    ''' 根据Query Set返回issue列表 '''
-    res = [issue.to_dict() for issue in issues]
+    ''' 根据Query Set返回issue列表
+    关联的用户、类别一并取出，所有资产树一次查询，同一棵树只取一次 '''
+    if hasattr(issues.model, 'assignee'):
+        issues = issues.select_related('initiator', 'handler', 'assignee', 'asset__category')
+    else:
+        issues = issues.select_related('initiator', 'asset_category').prefetch_related('asset')
+    issues = list(issues)
+    assets = [asset for issue in issues for asset in issue.get_assets()]
+    trees = Asset.get_entire_trees(assets)
+    res = [issue.to_dict(trees) for issue in issues]
     return res
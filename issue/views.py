@@ -1,4 +1,8 @@
 ''' views func for App issue '''
+from itertools import chain
+
+from django.db import transaction
+
 from app.utils import catch_exception, gen_response, parse_args
 from asset.models import Asset, AssetCategory
 from asset.utils import get_assets_list
@@ -50,7 +54,7 @@ def issue_require(request):
     para: category(str) 资产类别名 reason(str) 申领理由
     '''
     category, reason = parse_args(request.body, 'category', 'reason', reason='')
-    category: AssetCategory = AssetCategory.objects.get(name=category)
+    category: AssetCategory = AssetCategory.get_by_name(category)
     if RequireIssue.objects.filter(initiator=request.user,
                                    status='DOING', asset_category=category).exists():
         return gen_response(code=203, message='不能对同一类资产发起多个领用请求')
@@ -207,18 +211,12 @@ def issue_permit_require(request):
     if not asset_ids:
         return gen_response(code=204, message='没有指定任何资产')
     issue: RequireIssue = RequireIssue.objects.get(id=issue_id)
-    assets = set()
-    for asset_id in asset_ids:
-        asset: Asset = Asset.objects.get(id=asset_id)
-        assets.update(asset.get_entire_tree())
-    for asset in assets:
-        asset.owner = issue.initiator
-        asset.status = 'IN_USE'
-        asset._change_reason = '领用'
-        asset.save()
-        issue.asset.add(asset)
-    issue.status = 'SUCCESS'
-    issue.save()
+    with transaction.atomic():
+        trees = Asset.update_trees(Asset.get_tree_ids(asset_ids), '领用',
+                                   owner=issue.initiator, status='IN_USE')
+        issue.asset.add(*chain.from_iterable(trees.values()))
+        issue.status = 'SUCCESS'
+        issue.save()
     return gen_response(code=200, message=f"{request.user.username} 批准资产领用请求")
 
 
@@ -250,7 +248,7 @@ def require_asset_list(request):
     para: category(str)
     '''
     category = parse_args(request.body, 'category')[0]
-    category = AssetCategory.objects.get(name=category)
+    category = AssetCategory.get_by_name(category)
     assets = Asset.objects.filter(owner__department=request.user.department,
                                   status='IDLE', category=category)
     res = get_assets_list(assets)
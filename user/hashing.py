@@ -0,0 +1,140 @@
+'''
+密码哈希的进程池
+
+bcrypt 每次计算耗时数百毫秒，直接在处理请求的线程中计算会占满 CPU，使其他请求排队。
+check_password / set_password 将计算交给 PASSWORD_POOL_SIZE 个子进程，
+排队的任务超过 PASSWORD_POOL_QUEUE 时立即抛出 ServiceUnavailable，由 catch_exception 返回 503。
+PASSWORD_POOL_SIZE 为 0 时在当前线程中计算。
+'''
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from app.utils import ServiceUnavailable
+
+
+def timed(func, *args) -> tuple:
+    ''' 在子进程中执行 func，return: (耗时, 结果) '''
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def verify(password: str, encoded: str) -> tuple:
+    ''' return: (密码是否正确, 是否需要以当前的哈希算法重新计算) '''
+    updates = []
+    return hashers.check_password(password, encoded, setter=updates.append), bool(updates)
+
+
+class PasswordPool:
+    '''
+    有界的密码哈希进程池，子进程在第一次使用时由 forkserver 启动，
+    不继承请求线程持有的锁和数据库连接
+    '''
+
+    def __init__(self, size: int = None, queue: int = None, timeout: float = None):
+        self.size = settings.PASSWORD_POOL_SIZE if size is None else size
+        self.queue = settings.PASSWORD_POOL_QUEUE if queue is None else queue
+        self.timeout = settings.PASSWORD_POOL_TIMEOUT if timeout is None else timeout
+        self.slots = threading.BoundedSemaphore(self.size + self.queue)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.started = time.monotonic()
+        self.counts = {'submitted': 0, 'completed': 0, 'rejected': 0, 'failed': 0}
+        self.in_flight = 0
+        self.peak = 0
+        self.busy = 0.0
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        ''' 进程池，损坏后重新创建 '''
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    self.size, mp_context=multiprocessing.get_context('forkserver'))
+            return self.executor
+
+    def done(self, future):
+        ''' 任务真正结束后才释放名额，超时的任务仍计入排队数 '''
+        with self.lock:
+            self.in_flight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.counts['failed'] += 1
+            else:
+                self.counts['completed'] += 1
+                self.busy += future.result()[0]
+        self.slots.release()
+
+    def run(self, func, *args):
+        ''' 在进程池中执行 func，名额已满、超时或进程池损坏时抛出 ServiceUnavailable '''
+        if not self.size:
+            return func(*args)
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.counts['rejected'] += 1
+            raise ServiceUnavailable('服务繁忙，请稍后重试')
+        with self.lock:
+            self.counts['submitted'] += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        executor = self.get_executor()
+        try:
+            future = executor.submit(timed, func, *args)
+        except BrokenProcessPool:
+            future = None
+        if future is None:
+            with self.lock:
+                self.in_flight -= 1
+                self.counts['failed'] += 1
+                if self.executor is executor:
+                    self.executor = None
+            self.slots.release()
+            raise ServiceUnavailable('密码服务不可用，请稍后重试')
+        future.add_done_callback(self.done)
+        try:
+            return future.result(self.timeout)[1]
+        except FutureTimeout:
+            future.cancel()
+            raise ServiceUnavailable('服务繁忙，请稍后重试')
+        except BrokenProcessPool:
+            with self.lock:
+                if self.executor is executor:
+                    self.executor = None
+            raise ServiceUnavailable('密码服务不可用，请稍后重试')
+
+    def stats(self) -> dict:
+        ''' 进程池的使用情况，utilisation 为子进程计算时间占 size * uptime 的比例 '''
+        with self.lock:
+            uptime = time.monotonic() - self.started
+            return {
+                **self.counts,
+                'size': self.size,
+                'queue': self.queue,
+                'in_flight': self.in_flight,
+                'peak': self.peak,
+                'busy_seconds': round(self.busy, 3),
+                'uptime_seconds': round(uptime, 3),
+                'utilisation': round(self.busy / (self.size * uptime), 4) if self.size else 0,
+            }
+
+
+POOL = PasswordPool()
+
+
+def check_password(user, raw_password: str) -> bool:
+    ''' 同 User.check_password，哈希算法变化时以当前算法重新计算并保存 '''
+    valid, must_update = POOL.run(verify, raw_password, user.password)
+    if valid and must_update:
+        set_password(user, raw_password)
+        user.save(update_fields=['password'])
+    return valid
+
+
+def set_password(user, raw_password: str):
+    ''' 同 User.set_password，调用者负责保存 '''
+    user.password = POOL.run(hashers.make_password, raw_password)
+    user._password = raw_password  # pylint: disable=protected-access
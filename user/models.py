@@ -1,11 +1,16 @@
 ''' user/models.py '''
+import hashlib
+from collections import defaultdict
 from enum import Enum
 from datetime import datetime, timedelta
 
 import jwt
-from django.contrib.auth.models import (AbstractUser, Permission)
+from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.db import models
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 
+from app.refcache import RefCache, invalidate, remove
 from app.settings import SECRET_KEY
 from department.models import Department
 
@@ -30,6 +35,11 @@ class User(AbstractUser):
     active = models.BooleanField(auto_created=True, default=True)
     token = models.CharField(max_length=100, auto_created=True, default='', blank=True)
 
+    @property
+    def token_stamp(self) -> str:
+        ''' 用户的 token 吊销版本戳名，用户保存时更新、删除时删除，见 user.utils.TokenCache '''
+        return 'token_' + hashlib.md5(self.username.encode()).hexdigest()
+
     def generate_jwt_token(self):
         ''' generate token '''
         token = jwt.encode({
@@ -40,16 +50,24 @@ class User(AbstractUser):
         }, SECRET_KEY, algorithm='HS256')
         return token.decode('utf-8')
 
+    def get_roles(self) -> frozenset:
+        ''' 用户拥有的角色，与 has_perm 一致：未激活的用户没有角色，超级用户拥有全部角色 '''
+        if not self.is_active:
+            return frozenset()
+        if self.is_superuser:
+            return frozenset(ROLES)
+        return ROLE_MAP.get().get(self.username, frozenset())
+
     def gen_roles(self) -> list:
         ''' generate roles to deliver for a user '''
-        role = []
-        if self.has_perm(UserPermission.IT.value):
-            role.append('IT')
-        if self.has_perm(UserPermission.ASSET.value):
-            role.append('ASSET')
-        if self.has_perm(UserPermission.SYSTEM.value):
-            role.append('SYSTEM')
-        return role + ['STAFF']
+        roles = self.get_roles()
+        return [role for role in ROLES if role in roles] + ['STAFF']
+
+    def has_roles(self, perms) -> bool:
+        ''' 同 has_perms，UserPermission 中的权限由角色缓存回答，不查询数据库 '''
+        roles = self.get_roles()
+        return all(perm.split('.')[1] in roles if perm in ROLE_PERMS else self.has_perm(perm)
+                   for perm in perms)
 
     def set_roles(self, roles: list):
         ''' set roles/permissions for user '''
@@ -57,6 +75,8 @@ class User(AbstractUser):
         permissions = Permission.objects.filter(codename__in=roles)
         for per in permissions:
             self.user_permissions.add(per)
+        invalidate('user_roles')
+        invalidate('asset_manager')
 
     @classmethod
     def admin(cls):
@@ -69,3 +89,57 @@ class User(AbstractUser):
             ('SYSTEM', '系统管理员'),
             ('IT', 'IT管理员'),
         )
+
+
+ROLES = [perm.name for perm in UserPermission]
+ROLE_PERMS = {perm.value for perm in UserPermission}
+
+
+def load_roles() -> dict:
+    '''
+    一次联合查询用户权限表和用户组权限表，得到各用户被授予的角色
+    return: {username: {角色, ...}}
+    '''
+    direct = (User.user_permissions.through.objects
+              .filter(permission__content_type__app_label='user',
+                      permission__codename__in=ROLES)
+              .values_list('user_id', 'permission__codename'))
+    by_group = (User.groups.through.objects
+                .filter(group__permissions__content_type__app_label='user',
+                        group__permissions__codename__in=ROLES)
+                .values_list('user_id', 'group__permissions__codename'))
+    roles = defaultdict(set)
+    for username, role in direct.union(by_group):
+        roles[username].add(role)
+    return {username: frozenset(granted) for username, granted in roles.items()}
+
+
+ROLE_MAP = RefCache('user_roles', load_roles)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_asset_managers(**kwargs):
+    ''' 删除用户后重新计算各用户的角色和各部门的资产管理员 '''
+    invalidate('user_roles')
+    invalidate('asset_manager')
+
+
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_roles(**kwargs):
+    ''' 权限或用户组变化后重新计算各用户的角色和各部门的资产管理员 '''
+    invalidate('user_roles')
+    invalidate('asset_manager')
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens(instance, **kwargs):
+    ''' 登录、登出、锁定、改密等任何修改都使该用户已缓存的 token 验证结果失效 '''
+    invalidate(instance.token_stamp)
+
+
+@receiver(post_delete, sender=User)
+def remove_token_stamp(instance, **kwargs):
+    ''' 删除用户时删除其版本戳，版本戳文件数不超过用户数 '''
+    remove(instance.token_stamp)
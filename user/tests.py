@@ -1,9 +1,13 @@
 ''' user/test.py '''
 import json
+import os
 
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
 from django.test import TestCase
 
-from app.utils import init_test
+from app.refcache import stamp_path
+from app.utils import encode_cursor, init_test
 from .models import User, UserPermission
 
 
@@ -29,6 +33,52 @@ class UserTest(TestCase):
         response = self.client.get(path)
         self.assertEqual(response.json()['code'], 200)
 
+        group = Group.objects.create(name='asset')
+        group.permissions.add(Permission.objects.get(codename='ASSET'))
+        user = User.objects.get(username='zhanghx')
+        user.groups.add(group)
+        user.set_roles(['IT'])
+        for i in range(5):
+            User.objects.create(username=f'user{i}', department_id=self.department_id)
+        self.client.get(path)  # 预热角色缓存
+
+        with self.assertNumQueries(1):  # token 的验证结果已缓存，只查询用户列表
+            data = self.client.get(path).json()['data']
+        roles = {user['name']: user['role'] for user in data}
+        self.assertEqual(roles['zhanghx'], ['IT', 'ASSET', 'STAFF'])
+        self.assertEqual(roles['user0'], ['STAFF'])
+        self.assertEqual(roles['admin'], ['IT', 'ASSET', 'SYSTEM', 'STAFF'])
+
+        names, cursor = [], ''
+        while True:
+            response = self.client.get(path, {'cursor': cursor, 'size': 3}).json()
+            names += [user['name'] for user in response['data']]
+            cursor = response['next_cursor']
+            if not cursor:
+                break
+        self.assertEqual(names, [user['name'] for user in data])
+        self.assertEqual(len(names), len(set(names)))
+
+        response = self.client.get(path).json()  # 不给出 cursor 和 size 时不分页
+        self.assertEqual(len(response['data']), len(names))
+        self.assertEqual(response['next_cursor'], '')
+        response = self.client.get(path, {'cursor': encode_cursor(['user0'])}).json()
+        self.assertListEqual([user['name'] for user in response['data']],
+                             [name for name in names if name > 'user0'])
+
+        cursors = ['!', encode_cursor([]), encode_cursor({'name': 'admin'}), encode_cursor([None])]
+        for cursor in cursors:
+            response = self.client.get(path, {'cursor': cursor}).json()
+            self.assertEqual(response['code'], 201)
+
+        response = self.client.get(path, {'size': 'x'})
+        self.assertEqual(response.json()['code'], 201)
+
+        group.permissions.clear()
+        data = self.client.get(path).json()['data']
+        self.assertEqual({user['name']: user['role'] for user in data}['zhanghx'],
+                         ['IT', 'STAFF'])
+
     def test_user_exist(self):
         ''' views.user_exist '''
         path = '/api/user/exist'
@@ -212,6 +262,60 @@ class UserTest(TestCase):
         res = user_verified({'Token': token}, [UserPermission.IT.value])
         self.assertEqual(res, '权限不足')
 
+        stamp = stamp_path(user.token_stamp)
+        self.assertTrue(os.path.isfile(stamp))
+        user.delete()
+        self.assertFalse(os.path.isfile(stamp))
+        self.assertEqual(user_verified({'Token': token}, []), '用户不存在')
+
+        with self.assertNumQueries(1):  # 中间件验证一次，用户与部门一并取得
+            response = self.client.post('/api/user/info')
+        self.assertEqual(response.json()['userInfo']['department'], '总公司')
+        with self.assertNumQueries(0):  # 命中 token 缓存
+            response = self.client.post('/api/user/info')
+        self.assertEqual(response.json()['status'], 0)
+
+        admin = User.objects.get(username='admin')
+        admin.department.name = '公司'
+        admin.department.save()  # 部门变化使缓存失效
+        response = self.client.post('/api/user/info')
+        self.assertEqual(response.json()['userInfo']['department'], '公司')
+
+        token = self.client.cookies['Token'].value
+        self.client.post('/api/user/logout')
+        self.assertEqual(user_verified({'Token': token}, []), '用户不在线')
+
+    def test_password_pool(self):
+        ''' test for hashing.PasswordPool '''
+        from app.utils import ServiceUnavailable
+        from .hashing import POOL, PasswordPool, verify
+
+        pool = PasswordPool(size=1, queue=0, timeout=10)
+        encoded = make_password('secret')
+        self.assertEqual(pool.run(verify, 'secret', encoded), (True, False))
+        pool.slots.acquire()  # 名额已满
+        with self.assertRaises(ServiceUnavailable):
+            pool.run(verify, 'secret', encoded)
+        pool.slots.release()
+        stats = pool.stats()
+        self.assertEqual((stats['completed'], stats['rejected'], stats['in_flight']), (1, 1, 0))
+        self.assertGreater(stats['busy_seconds'], 0)
+
+        path = '/api/user/password-pool'
+        self.assertGreater(self.client.get(path).json()['data']['completed'], 0)
+
+        for _ in range(POOL.size + POOL.queue):
+            POOL.slots.acquire()
+        try:
+            response = self.client.post(self.login_path,
+                                        data=json.dumps({'username': 'zhanghx',
+                                                         self.pwd: 'zhanghx'}),
+                                        content_type='json')
+        finally:
+            for _ in range(POOL.size + POOL.queue):
+                POOL.slots.release()
+        self.assertEqual(response.json()['code'], 503)
+
     def test_user_assets(self):
         ''' test for user/asset '''
         response = self.client.get('/api/user/assets')
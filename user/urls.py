@@ -15,4 +15,5 @@ urlpatterns = [
     path('lock', views.user_lock),
     path('change-password', views.user_change_password),
     path('assets', views.user_assets),
+    path('password-pool', views.user_password_pool),
 ]
@@ -1,35 +1,115 @@
 ''' utils for App user '''
+import copy
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from functools import partial, wraps
 
 import jwt
+from django.conf import settings
 
+from app.refcache import read_stamp
 from app.settings import SECRET_KEY
-from app.utils import gen_response
+from app.utils import MAX_PAGE_SIZE, PAGE_SIZE, decode_cursor, encode_cursor, gen_response
 from .models import User
 
 
-def user_verified(cookies, perms) -> str:
+class TokenCache:
     '''
-    验证 token 是否合法，
-    与装饰器分离以便测试
+    已验证 token 的进程内 LRU 缓存，以 token 的摘要为键，保存用户及其部门
+
+    每项记下加载时用户的吊销版本戳 (User.token_stamp) 和部门版本戳，
+    任一版本戳变化、超过 TOKEN_CACHE_TTL 或 token 过期时失效，
+    命中时不需要验证签名，也不需要查询数据库
+    '''
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def stamps(user: User) -> tuple:
+        ''' 该用户的缓存项依赖的版本戳 '''
+        return read_stamp(user.token_stamp), read_stamp('department')
+
+    def get(self, key: bytes):
+        ''' 缓存的用户的副本，未命中时返回 None '''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+        user, stamps, expires = entry
+        if time.time() >= expires or self.stamps(user) != stamps:
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        return copy.deepcopy(user)  # 视图可能修改 request.user
+
+    def put(self, key: bytes, user: User, stamps: tuple, exp: int):
+        ''' stamps 须在查询用户之前读取，以免漏掉查询期间的修改 '''
+        expires = min(time.time() + settings.TOKEN_CACHE_TTL, exp)
+        with self.lock:
+            self.entries[key] = (copy.deepcopy(user), stamps, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > settings.TOKEN_CACHE_SIZE:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        ''' 清空缓存 '''
+        with self.lock:
+            self.entries.clear()
+
+
+TOKENS = TokenCache()
+
+
+def authenticate(cookies) -> tuple:
+    '''
+    验证 cookies 里的 token，并在同一次查询中取得用户及其部门，
+    验证通过的结果缓存于 TOKENS
+    return: (用户，token 无法解析或用户不存在时为 None, 'OK' 或错误信息)
     '''
     try:
         token = cookies['Token']
     except KeyError:
-        return 'Token 未给出'
+        return None, 'Token 未给出'
+    key = hashlib.sha256(str(token).encode()).digest()
+    user = TOKENS.get(key)
+    if user is not None:
+        return user, 'OK'
     try:
         decoded = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
     except jwt.ExpiredSignatureError:
-        return 'Token 已过期'
+        return None, 'Token 已过期'
     except jwt.InvalidTokenError:
-        return 'Token 不合法'
+        return None, 'Token 不合法'
 
-    user: User = User.objects.get(username=decoded['username'])
+    try:
+        stamps = TokenCache.stamps(User(username=decoded['username']))
+        user = User.objects.select_related('department').get(username=decoded['username'])
+    except (KeyError, User.DoesNotExist):
+        return None, '用户不存在'
     if user.token != token:
-        return '用户不在线'
-    if not user.has_perms(perms):
+        return user, '用户不在线'
+    TOKENS.put(key, user, stamps, decoded.get('exp', float('inf')))
+    return user, 'OK'
+
+
+def check_perms(user, verified: str, perms) -> str:
+    ''' 在 authenticate 的结果上检查权限，角色权限由 User.has_roles 的缓存回答 '''
+    if verified == 'OK' and not user.has_roles(perms):
         return '权限不足'
-    return 'OK'
+    return verified
+
+
+def user_verified(cookies, perms) -> str:
+    '''
+    验证 token 是否合法，
+    与装饰器分离以便测试
+    '''
+    return check_perms(*authenticate(cookies), perms)
 
 
 def auth_permission_required(*perms):
@@ -37,6 +117,7 @@ def auth_permission_required(*perms):
     用于用户验证的装饰器
     该装饰器会验证 cookies 里的 token 是否合法，
     错误时返回 status=1, code=401
+    token 已由 RequestLogMiddleware 验证，这里只读取 request.auth_context
 
     例:
     @catch_exception('POST')
@@ -51,9 +132,46 @@ def auth_permission_required(*perms):
         @wraps(view_func)
         def _wrapped_view(request, *args, **kwargs):
             ''' 装饰器内函数 '''
-            verified = user_verified(request.COOKIES, perms)
+            context = getattr(request, 'auth_context', None) or authenticate(request.COOKIES)
+            verified = check_perms(*context, perms)
             if verified != 'OK':
                 return error_response(message=verified)
             return view_func(request, *args, **kwargs)
         return _wrapped_view
     return decorator
+
+
+def get_users_page(cursor: str = '', size='') -> tuple:
+    '''
+    按用户名分页获得用户列表，部门随用户一起查询，角色来自 User.get_roles 的缓存
+    size 默认 PAGE_SIZE，不超过 MAX_PAGE_SIZE，cursor 和 size 都未给出时不分页，返回全部用户
+    return: (用户列表, next_cursor)，没有下一页时 next_cursor 为空串
+    '''
+    try:
+        size = min(max(int(size), 1), MAX_PAGE_SIZE) if size not in (None, '') else None
+    except (TypeError, ValueError):
+        raise KeyError('http 参数 size 不合法')
+    if cursor and size is None:
+        size = PAGE_SIZE
+    users = User.objects.select_related('department').order_by('username')
+    if cursor:
+        username = decode_cursor(cursor, 1)[0]
+        if not isinstance(username, str):
+            raise KeyError('http 参数 cursor 不合法')
+        users = users.filter(username__gt=username)
+    next_cursor = ''
+    if size is None:
+        users = list(users)
+    else:
+        users = list(users[:size + 1])
+        if len(users) > size:
+            users = users[:size]
+            next_cursor = encode_cursor([users[-1].username])
+    res = [{
+        'name': user.username,
+        'department': user.department.name,
+        'department_id': user.department_id,
+        'role': user.gen_roles(),
+        'is_active': user.active,
+    } for user in users]
+    return res, next_cursor
@@ -3,8 +3,9 @@ from app.utils import catch_exception, gen_response, parse_args
 from asset.models import Asset
 from asset.utils import get_assets_list
 from department.models import Department
-from .models import User
-from .utils import auth_permission_required
+from .hashing import POOL, check_password, set_password
+from .models import User, UserPermission
+from .utils import auth_permission_required, get_users_page
 
 
 @catch_exception('GET')
@@ -12,19 +13,15 @@ from .utils import auth_permission_required
 def user_list(request):
     '''
     api/user/list GET
-    返回所有用户的列表。
-    return: data([{}]), code =
+    按用户名分页返回用户的列表。
+    para: cursor(str) 上一页返回的 next_cursor, size(int) = 100
+        cursor 和 size 都未给出时返回全部用户
+    return: data([{}]), next_cursor(str) 没有下一页时为空串, code =
         200: success
     '''
-    all_user = User.objects.filter()
-    res = [{
-        'name': user.username,
-        'department': user.department.name,
-        'department_id': user.department.id,
-        'role': user.gen_roles(),
-        'is_active': user.active,
-    } for user in all_user]
-    return gen_response(code=200, data=res)
+    res, next_cursor = get_users_page(request.GET.get('cursor', ''),
+                                      request.GET.get('size', ''))
+    return gen_response(code=200, data=res, next_cursor=next_cursor)
 
 
 @catch_exception('POST')
@@ -85,7 +82,7 @@ def user_add(request):
 
     user = User(username=name,
                 department=department)
-    user.set_password('123456')
+    set_password(user, '123456')
     user.full_clean()
     user.save()
     user.set_roles(roles)
@@ -112,14 +109,14 @@ def user_edit(request):
 
     user = User.objects.get(username=name)
     if pwd != '':
-        user.set_password(pwd)
+        set_password(user, pwd)
     try:
         department = Department.objects.get(id=department_id)
     except Department.DoesNotExist:
         department = Department.root()
     user.department = department
     user.save()
-    user.set_roles(roles)
+    user.set_roles(roles)  # 同时使各部门资产管理员的缓存失效
 
     return gen_response(code=200, message=f'{user.username} 信息修改')
 
@@ -153,6 +150,7 @@ def user_login(request):
     para: username(str), password(str)
     return: code =
         201: parameter error
+        503: 密码服务繁忙
             status =
         0: success
         1: fall
@@ -161,7 +159,7 @@ def user_login(request):
     name, pwd = parse_args(request.body, 'username', 'password')
     user = User.objects.get(username=name)
 
-    if not user.check_password(pwd):
+    if not check_password(user, pwd):
         return gen_response(message='密码有误', status=1)
     if not user.active:
         return gen_response(message='用户不处于活跃状态', status=1)
@@ -218,9 +216,9 @@ def user_change_password(request):
     user = request.user
     old_pwd, new_pwd = parse_args(request.body, 'oldPassword', 'newPassword')
 
-    if not user.check_password(old_pwd):
+    if not check_password(user, old_pwd):
         return gen_response(message='旧密码错误', code=202)
-    user.set_password(new_pwd)
+    set_password(user, new_pwd)
     user.save()
     return gen_response(code=200, message=f'用户 {user.username} 密码更改')
 
@@ -235,3 +233,15 @@ def user_assets(request):
     assets = Asset.objects.filter(owner=user, status='IN_USE')
     res = get_assets_list(assets)
     return gen_response(data=res, code=200)
+
+
+@catch_exception('GET')
+@auth_permission_required(UserPermission.SYSTEM.value)
+def user_password_pool(request):
+    ''' api/user/password-pool GET
+    当前进程中密码哈希进程池的使用情况
+    return: data({submitted, completed, rejected, failed, size, queue, in_flight, peak,
+        busy_seconds, uptime_seconds, utilisation}), code =
+        200: success
+    '''
+    return gen_response(code=200, data=POOL.stats())